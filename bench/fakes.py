@@ -0,0 +1,136 @@
+import asyncio
+import datetime
+import itertools
+import random
+from types import SimpleNamespace
+
+from telegram import Chat, Message, PhotoSize, Update
+from telethon.tl.types import (
+    MessageReactions, ReactionCount, ReactionEmoji, UpdateMessageReactions
+)
+
+EMOJIS = ['👍', '❤', '🔥', '😁', '🤔']
+
+
+class Latency:
+    """Random delay of ``mean`` seconds on average, spread by ``jitter`` in either direction."""
+
+    def __init__(self, mean=0.0, jitter=0.0):
+        self.mean = mean
+        self.jitter = jitter
+
+    async def wait(self):
+        delay = self.mean + random.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class FakeBot:
+    """In-process stand-in for a PTB Bot that answers with message IDs after a delay."""
+
+    def __init__(self, latency=None):
+        self.latency = latency or Latency()
+        self.calls = 0
+        self._ids = {}
+
+    def _next_id(self, chat_id):
+        self._ids.setdefault(chat_id, itertools.count(10 ** 9))
+        return next(self._ids[chat_id])
+
+    async def _call(self, chat_id, count=None):
+        self.calls += 1
+        await self.latency.wait()
+        if count is None:
+            return SimpleNamespace(message_id=self._next_id(chat_id))
+        return [SimpleNamespace(message_id=self._next_id(chat_id)) for _ in range(count)]
+
+    async def send_message(self, chat_id, text, **kwargs):
+        return await self._call(chat_id)
+
+    async def copy_message(self, chat_id, from_chat_id, message_id, **kwargs):
+        return await self._call(chat_id)
+
+    async def forward_message(self, chat_id, from_chat_id, message_id, **kwargs):
+        return await self._call(chat_id)
+
+    async def copy_messages(self, chat_id, from_chat_id, message_ids, **kwargs):
+        return tuple(await self._call(chat_id, len(message_ids)))
+
+    async def forward_messages(self, chat_id, from_chat_id, message_ids, **kwargs):
+        return tuple(await self._call(chat_id, len(message_ids)))
+
+    async def send_media_group(self, chat_id, media, **kwargs):
+        return await self._call(chat_id, len(media))
+
+    async def edit_message_text(self, chat_id, message_id, text, **kwargs):
+        await self._call(chat_id)
+        return True
+
+    async def edit_message_caption(self, chat_id, message_id, caption=None, **kwargs):
+        await self._call(chat_id)
+        return True
+
+
+class FakeTelegramClient:
+    """In-process stand-in for the Telethon client, answering reaction requests with random counts."""
+
+    def __init__(self, latency=None, change_rate=0.2):
+        self.latency = latency or Latency()
+        self.change_rate = change_rate
+        self.calls = 0
+
+    def is_connected(self):
+        return True
+
+    async def __call__(self, request):
+        self.calls += 1
+        await self.latency.wait()
+        updates = []
+        for message_id in request.id:
+            if random.random() < self.change_rate:
+                updates.append(UpdateMessageReactions(
+                    peer=request.peer,
+                    msg_id=message_id,
+                    reactions=random_reactions(),
+                ))
+        return SimpleNamespace(updates=updates)
+
+    async def get_messages(self, peer, ids):
+        self.calls += 1
+        await self.latency.wait()
+        return [SimpleNamespace(id=message_id, message="benchmark message", media=None) for message_id in ids]
+
+
+def random_reactions():
+    return MessageReactions(results=[
+        ReactionCount(reaction=ReactionEmoji(emoticon=emoji), count=random.randint(1, 50))
+        for emoji in random.sample(EMOJIS, random.randint(1, 3))
+    ])
+
+
+def random_reactions_dict():
+    return {emoji: random.randint(1, 50) for emoji in random.sample(EMOJIS, random.randint(1, 3))}
+
+
+def make_post(update_id, channel_id, message_id, text=None, reply_to=None, media_group_id=None, edited=False):
+    """Build a PTB channel post update; posts without text are photos."""
+    chat = Chat(channel_id, Chat.CHANNEL)
+    date = datetime.datetime.now(datetime.timezone.utc)
+    reply_to_message = Message(reply_to, date, chat, text="replied") if reply_to else None
+    if text is not None:
+        message = Message(message_id, date, chat, text=text, reply_to_message=reply_to_message)
+    else:
+        message = Message(
+            message_id, date, chat,
+            photo=(PhotoSize(f"file{message_id}", f"unique{message_id}", 1280, 720),),
+            caption=f"photo {message_id}",
+            media_group_id=media_group_id,
+            reply_to_message=reply_to_message,
+        )
+    if edited:
+        return Update(update_id, edited_channel_post=message)
+    return Update(update_id, channel_post=message)
+
+
+def make_context(bot):
+    return SimpleNamespace(bot=bot)
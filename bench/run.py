@@ -0,0 +1,265 @@
+"""
+Benchmark the bridge handlers in-process against fake Bot and Telethon clients.
+
+Run from the repository root:
+
+    python -m bench.run --posts 2000 --albums 100 --rows 1000000
+
+The mapping database is pre-populated once with ``--rows`` mappings and reused by later
+runs. Flood control is disabled unless ``--flood-control`` is given, so the numbers
+reflect the bridge itself plus the configured fake latencies.
+"""
+import argparse
+import asyncio
+import logging
+import math
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default=os.path.join(tempfile.gettempdir(), "anon-sharding-bench.db"))
+    parser.add_argument("--rows", type=int, default=1_000_000, help="mappings to pre-populate the database with")
+    parser.add_argument("--channels", type=int, default=3, help="channels in the shard group")
+    parser.add_argument("--posts", type=int, default=2000)
+    parser.add_argument("--reply-ratio", type=float, default=0.3, help="share of posts replying to the previous one")
+    parser.add_argument("--albums", type=int, default=100)
+    parser.add_argument("--album-size", type=int, default=10)
+    parser.add_argument("--edits", type=int, default=1000)
+    parser.add_argument("--reactions", type=int, default=2000, help="reaction changes in the reaction storm")
+    parser.add_argument("--poll-cycles", type=int, default=50)
+    parser.add_argument("--bot-latency", type=float, default=0.02, help="mean Bot API latency in seconds")
+    parser.add_argument("--telethon-latency", type=float, default=0.03, help="mean Telethon latency in seconds")
+    parser.add_argument("--concurrency", type=int, default=8, help="updates processed at once")
+    parser.add_argument("--flood-control", action="store_true", help="keep the production outbound rate limits")
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--seed", type=int, default=1)
+    return parser.parse_args()
+
+
+def configure_environment(args):
+    """Set the bridge configuration, main_ptb reads it on import."""
+    channels = [-1001000000001 - i for i in range(args.channels)]
+    os.environ.update({
+        "API_TOKEN": "0:bench",
+        "API_ID": "1",
+        "API_HASH": "bench",
+        "SHARD_GROUPS": ",".join(str(channel) for channel in channels),
+        "DB_PATH": args.db,
+        "MEDIA_GROUP_QUIET_GAP": "0.05",
+        "MEDIA_GROUP_MAX_WAIT": "0.5",
+        "EDIT_DEBOUNCE": "0.05",
+        "REACTION_POLL_BUDGET": "5",
+    })
+    if not args.flood_control:
+        os.environ.update({
+            "OUTBOUND_GLOBAL_RATE": "1000000",
+            "OUTBOUND_CHAT_RATE": "1000000",
+            "OUTBOUND_CHAT_BURST": "1000000",
+        })
+    return channels
+
+
+def populate(path, rows, channels):
+    """Fill the mapping table with ``rows`` mappings of old posts, unless it already has them."""
+    conn = sqlite3.connect(path)
+    try:
+        existing = conn.execute("SELECT COUNT(*) FROM message_mapping").fetchone()[0]
+        if existing >= rows:
+            return existing
+        print(f"Populating {path} with {rows} mappings...")
+        now = int(time.time())
+        copies = len(channels) - 1
+        conn.execute("DELETE FROM message_mapping")
+
+        def generate():
+            for i in range(rows):
+                original_id, copy_index = divmod(i, copies)
+                original_channel = channels[original_id % len(channels)]
+                copied_channel = [channel for channel in channels if channel != original_channel][copy_index]
+                yield (original_channel, original_id + 1, copied_channel, 10 ** 8 + i,
+                       now - random.randint(0, 60 * 86400))
+
+        conn.executemany(
+            "INSERT INTO message_mapping (original_channel, original_id, copied_channel, copied_id, created_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            generate()
+        )
+        conn.commit()
+        return rows
+    finally:
+        conn.close()
+
+
+def sqlite_seconds():
+    from metrics import SQLITE_SECONDS
+    return {labels: value for name, labels, value in SQLITE_SECONDS.samples() if name.endswith("_sum")}
+
+
+class Stage:
+    """Collects latencies, wall time and database time of one workload."""
+
+    def __init__(self, name):
+        self.name = name
+        self.latencies = []
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        self.db_start = sqlite_seconds()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.wall = time.perf_counter() - self.start
+        db_end = sqlite_seconds()
+        self.db = sum(value - self.db_start.get(labels, 0.0) for labels, value in db_end.items())
+
+    async def timed(self, coroutine):
+        start = time.perf_counter()
+        try:
+            return await coroutine
+        finally:
+            self.latencies.append(time.perf_counter() - start)
+
+    def report(self):
+        latencies = sorted(self.latencies)
+        count = len(latencies)
+
+        def percentile(p):
+            if not latencies:
+                return math.nan
+            return latencies[min(count - 1, int(p * count))] * 1000
+
+        throughput = count / self.wall if self.wall else math.nan
+        mean = statistics.fmean(latencies) * 1000 if latencies else math.nan
+        return (f"{self.name:<18} {count:>7} {self.wall:>8.2f}s {throughput:>9.1f}/s "
+                f"{mean:>8.1f} {percentile(0.5):>8.1f} {percentile(0.99):>8.1f} {self.db:>8.2f}s")
+
+
+async def wait_until_idle(main_ptb):
+    while len(main_ptb.edit_queue) or len(main_ptb.outbound) or len(main_ptb.media_groups) or main_ptb.pending_posts:
+        await asyncio.sleep(0.01)
+
+
+async def run(args, channels):
+    import main_ptb
+    from update_processor import KeyedUpdateProcessor
+    from bench.fakes import (
+        FakeBot, FakeTelegramClient, Latency, make_context, make_post, random_reactions_dict
+    )
+
+    bot = FakeBot(Latency(args.bot_latency, args.bot_latency / 2))
+    main_ptb.telethon_client = FakeTelegramClient(Latency(args.telethon_latency, args.telethon_latency / 2))
+    context = make_context(bot)
+    processor = KeyedUpdateProcessor(args.concurrency)
+    update_ids = iter(range(1, 10 ** 9))
+    message_ids = {channel: iter(range(10 ** 7, 10 ** 8)) for channel in channels}
+
+    await main_ptb.warm_mapping_cache()
+    await main_ptb.load_reaction_state()
+    stages = []
+
+    # Single posts, some replying to the previous post of their channel
+    stage = Stage("posts")
+    posts = []
+    last_post = {}
+    with stage:
+        jobs = []
+        for i in range(args.posts):
+            channel = channels[i % len(channels)]
+            message_id = next(message_ids[channel])
+            reply_to = last_post.get(channel) if random.random() < args.reply_ratio else None
+            update = make_post(next(update_ids), channel, message_id, text=f"post {i} https://x.com/a/{i}", reply_to=reply_to)
+            last_post[channel] = message_id
+            posts.append((channel, message_id))
+            jobs.append(processor.process_update(update, stage.timed(main_ptb.channel_post_handler(update, context))))
+        await asyncio.gather(*jobs)
+        await wait_until_idle(main_ptb)
+    stages.append(stage)
+
+    # Albums, measured from the first item until the album is mirrored
+    stage = Stage("albums")
+    with stage:
+        async def send_album(index):
+            channel = channels[index % len(channels)]
+            ids = [next(message_ids[channel]) for _ in range(args.album_size)]
+            start = time.perf_counter()
+            for message_id in ids:
+                update = make_post(next(update_ids), channel, message_id, media_group_id=f"album{index}")
+                await processor.process_update(update, main_ptb.channel_post_handler(update, context))
+            await asyncio.sleep(0)
+            await main_ptb.wait_for_post(channel, ids[0])
+            stage.latencies.append(time.perf_counter() - start)
+
+        await asyncio.gather(*(send_album(i) for i in range(args.albums)))
+        await wait_until_idle(main_ptb)
+    stages.append(stage)
+
+    # Edits of mirrored posts
+    stage = Stage("edits")
+    with stage:
+        jobs = []
+        for i, (channel, message_id) in enumerate(random.sample(posts, min(args.edits, len(posts)))):
+            update = make_post(next(update_ids), channel, message_id, text=f"edited {i} https://x.com/e/{i}", edited=True)
+            jobs.append(processor.process_update(update, stage.timed(main_ptb.edited_channel_post_handler(update, context))))
+        await asyncio.gather(*jobs)
+        await wait_until_idle(main_ptb)
+    stages.append(stage)
+
+    # Reaction storm on recent posts, as pushed by Telethon
+    stage = Stage("reaction storm")
+    semaphore = asyncio.Semaphore(args.concurrency)
+    with stage:
+        async def react():
+            channel, message_id = random.choice(posts)
+            async with semaphore:
+                await stage.timed(main_ptb.process_reaction_change(
+                    bot, main_ptb.to_telethon_channel(channel), message_id, random_reactions_dict()
+                ))
+
+        await asyncio.gather(*(react() for _ in range(args.reactions)))
+        await wait_until_idle(main_ptb)
+        await main_ptb.flush_reactions()
+    stages.append(stage)
+
+    # Reaction polling cycles over the whole schedule, everything is due
+    await main_ptb.load_reaction_schedule()
+    stage = Stage("poll cycles")
+    with stage:
+        for _ in range(args.poll_cycles):
+            await stage.timed(main_ptb.run_reaction_poll_cycle(bot, now=math.inf))
+        await wait_until_idle(main_ptb)
+        await main_ptb.flush_reactions()
+    stages.append(stage)
+
+    print()
+    print(f"{'stage':<18} {'count':>7} {'wall':>9} {'throughput':>11} {'mean ms':>8} {'p50 ms':>8} {'p99 ms':>8} {'db time':>9}")
+    for stage in stages:
+        print(stage.report())
+    print(f"\nBot API calls: {bot.calls}, Telethon calls: {main_ptb.telethon_client.calls}, "
+          f"mapping cache: {main_ptb.mapping_cache.stats()}")
+
+
+def main():
+    args = parse_args()
+    random.seed(args.seed)
+    channels = configure_environment(args)
+
+    # Importing main_ptb creates the schema
+    import main_ptb
+    logging.getLogger("log").setLevel(args.log_level)
+    rows = populate(args.db, args.rows, channels)
+    print(f"Database {args.db} holds {rows} mappings")
+
+    try:
+        asyncio.run(run(args, channels))
+    finally:
+        main_ptb.storage.close()
+
+
+if __name__ == "__main__":
+    main()
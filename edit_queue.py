@@ -0,0 +1,132 @@
+import asyncio
+import heapq
+from collections import OrderedDict
+
+from telegram.error import BadRequest
+
+from log import get_logger
+from outbound import PRIORITY_EDIT
+
+logger = get_logger("edit_queue")
+
+
+class EditQueue:
+    """Coalescing queue of outbound message edits.
+
+    Edits are keyed by ``(chat_id, message_id)`` and sent through ``scheduler``. An edit
+    is applied ``debounce`` seconds after it was first submitted, with whatever text was
+    submitted last for that message by then. Edits whose text and entities match what was last successfully applied are
+    skipped, and Telegram's "message is not modified" error counts as success.
+    """
+
+    def __init__(self, scheduler, debounce=1.0, applied_cache_size=10000):
+        self.scheduler = scheduler
+        self.debounce = debounce
+        self.applied_cache_size = applied_cache_size
+        self._pending = {}
+        self._deadlines = []
+        self._in_flight = set()
+        self._applied = OrderedDict()
+        self._wakeup = None
+        self._worker = None
+
+    def __len__(self):
+        return len(self._pending)
+
+    def submit(self, bot, chat_id, message_id, text, entities=None, is_caption=False, priority=PRIORITY_EDIT):
+        """
+        Queue an edit and return a future resolving to whether the message now shows ``text``.
+        A merged edit is sent with the most urgent priority among the merged submissions.
+        """
+        loop = asyncio.get_running_loop()
+        if self._worker is None or self._worker.done():
+            self._wakeup = asyncio.Event()
+            self._worker = loop.create_task(self._run())
+
+        key = (chat_id, message_id)
+        future = loop.create_future()
+        entry = self._pending.get(key)
+        if entry is None:
+            entry = self._pending[key] = {'futures': [], 'priority': priority}
+            heapq.heappush(self._deadlines, (loop.time() + self.debounce, key))
+            self._wakeup.set()
+        entry.update(bot=bot, text=text, entities=tuple(entities or ()), is_caption=is_caption,
+                     priority=min(entry['priority'], priority))
+        entry['futures'].append(future)
+        return future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            self._wakeup.clear()
+            if not self._deadlines:
+                await self._wakeup.wait()
+                continue
+
+            deadline, key = self._deadlines[0]
+            delay = deadline - loop.time()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            heapq.heappop(self._deadlines)
+            if key in self._in_flight:
+                # Never run two edits of the same message at once, retry after the current one
+                heapq.heappush(self._deadlines, (loop.time() + self.debounce, key))
+                continue
+            entry = self._pending.pop(key)
+            self._in_flight.add(key)
+            loop.create_task(self._apply(key, entry))
+
+    async def _apply(self, key, entry):
+        chat_id, message_id = key
+        state = (entry['text'], entry['entities'])
+        try:
+            if self._applied.get(key) == state:
+                success = True
+            else:
+                success = await self._edit(entry, chat_id, message_id)
+                if success:
+                    self._applied[key] = state
+                    self._applied.move_to_end(key)
+                    while len(self._applied) > self.applied_cache_size:
+                        self._applied.popitem(last=False)
+        finally:
+            self._in_flight.discard(key)
+        for future in entry['futures']:
+            if not future.done():
+                future.set_result(success)
+
+    async def _edit(self, entry, chat_id, message_id):
+        bot = entry['bot']
+        try:
+            if entry['is_caption']:
+                await self.scheduler.call(
+                    entry['priority'],
+                    bot.edit_message_caption,
+                    chat_id=chat_id,
+                    message_id=message_id,
+                    caption=entry['text'],
+                    caption_entities=entry['entities'] or None
+                )
+            else:
+                await self.scheduler.call(
+                    entry['priority'],
+                    bot.edit_message_text,
+                    chat_id=chat_id,
+                    message_id=message_id,
+                    text=entry['text'],
+                    entities=entry['entities'] or None
+                )
+            return True
+        except BadRequest as e:
+            if "not modified" in str(e).lower():
+                return True
+            logger.error("Error editing message %s in chat %s: %s", message_id, chat_id, e)
+            return False
+        except Exception as e:
+            logger.error("Error editing message %s in chat %s: %s", message_id, chat_id, e)
+            return False
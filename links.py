@@ -0,0 +1,119 @@
+import re
+
+from telegram import MessageEntity
+
+# Hosts rewritten to embed-friendly mirrors by default
+DEFAULT_LINK_RULES = (
+    "x.com=fxtwitter.com,"
+    "twitter.com=fxtwitter.com,"
+    "instagram.com=ddinstagram.com,"
+    "tiktok.com=vxtiktok.com,"
+    "reddit.com=rxddit.com"
+)
+
+
+def parse_link_rules(spec):
+    """Parse "host=replacement,host=replacement,..." into a dict of lowercase hosts."""
+    rules = {}
+    for rule in spec.split(','):
+        if not rule.strip():
+            continue
+        host, sep, replacement = rule.partition('=')
+        if not sep or not host.strip() or not replacement.strip():
+            raise ValueError(f"Invalid link rewrite rule {rule!r}, expected host=replacement")
+        rules[host.strip().lower()] = replacement.strip()
+    return rules
+
+
+def utf16_len(text):
+    """Length of a string in UTF-16 code units, the unit of Telegram entity offsets."""
+    return len(text.encode('utf-16-le')) // 2
+
+
+class LinkRewriter:
+    """Rewrites links to configured hosts in one pass over the text.
+
+    All hosts are compiled into a single pattern; a link like ``https://www.x.com/...``
+    keeps its scheme and loses the ``www.``. Texts that contain none of the hosts are
+    returned untouched without running the pattern. Entities are shifted by the change
+    in length of every rewritten link, counted in UTF-16 code units.
+    """
+
+    def __init__(self, rules):
+        self.rules = {host.lower(): replacement for host, replacement in rules.items()}
+        # Longest hosts first, so a host is never cut short by another it ends with
+        hosts = sorted(self.rules, key=len, reverse=True)
+        self._pattern = re.compile(
+            r"(?i)\b((?:https?://)?)(?:www\.)?(" + "|".join(re.escape(host) for host in hosts) + r")(?=/|\b)"
+        ) if hosts else None
+
+    def _has_candidate(self, text):
+        if not text or self._pattern is None:
+            return False
+        lowered = text.lower()
+        return any(host in lowered for host in self.rules)
+
+    def rewrite_text(self, text):
+        """Rewrite the links of a text without entities."""
+        if not self._has_candidate(text):
+            return text
+        return self._pattern.sub(lambda match: match.group(1) + self.rules[match.group(2).lower()], text)
+
+    def rewrite(self, text, entities=None):
+        """Rewrite the links of a text, returning the new text and its adjusted entities."""
+        if not self._has_candidate(text):
+            return text, entities
+
+        parts = []
+        # (start, end, start + replacement length) of every rewritten link, in UTF-16 offsets of the original text
+        edits = []
+        position = 0
+        offset = 0
+        for match in self._pattern.finditer(text):
+            start, end = match.span()
+            replacement = match.group(1) + self.rules[match.group(2).lower()]
+            parts.append(text[position:start])
+            offset += utf16_len(text[position:start])
+            old_length = utf16_len(match.group(0))
+            edits.append((offset, offset + old_length, offset + utf16_len(replacement)))
+            parts.append(replacement)
+            offset += old_length
+            position = end
+        if not edits:
+            return text, entities
+        parts.append(text[position:])
+        new_text = "".join(parts)
+        if not entities:
+            return new_text, entities
+        return new_text, tuple(self._shift_entity(entity, edits) for entity in entities)
+
+    def _shift_entity(self, entity, edits):
+        start = entity.offset
+        end = entity.offset + entity.length
+        new_start = self._shift(start, edits, at_end=False)
+        new_end = self._shift(end, edits, at_end=True)
+        url = self.rewrite_text(entity.url) if entity.url else entity.url
+        if (new_start, new_end, url) == (start, end, entity.url):
+            return entity
+        return MessageEntity(
+            type=entity.type,
+            offset=new_start,
+            length=new_end - new_start,
+            url=url,
+            user=entity.user,
+            language=entity.language,
+            custom_emoji_id=entity.custom_emoji_id,
+        )
+
+    @staticmethod
+    def _shift(position, edits, at_end):
+        """Map an offset of the old text to the new text. Offsets inside a link move to its start or end."""
+        shift = 0
+        for start, end, new_end in edits:
+            if end <= position:
+                shift += new_end - end
+            elif start < position:
+                return (start + shift) if not at_end else (new_end + shift)
+            else:
+                break
+        return position + shift
@@ -0,0 +1,174 @@
+"""
+Soak-test the bridge over real HTTP against a local fake Bot API server.
+
+Run from the repository root:
+
+    python -m loadtest.driver --rate 20 --duration 300 --rate-429 0.02 --rate-5xx 0.01
+
+The driver serves the fake Bot API, starts main_ptb.py pointed at it through
+BOT_API_BASE_URL (use --no-spawn to run the bot yourself), injects channel posts at the
+given rate and reports how long the copies took to arrive. Telethon is disabled in the
+spawned bot, so reactions are not exercised.
+"""
+import argparse
+import asyncio
+import os
+import random
+import signal
+import sys
+import tempfile
+import time
+
+from aiohttp import web
+
+from loadtest.fake_bot_api import FakeBotApi
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--channels", type=int, default=3, help="channels in the shard group")
+    parser.add_argument("--rate", type=float, default=5, help="posts injected per second")
+    parser.add_argument("--duration", type=float, default=60, help="seconds to inject posts for")
+    parser.add_argument("--drain", type=float, default=60, help="seconds to wait for the last copies")
+    parser.add_argument("--album-ratio", type=float, default=0.1)
+    parser.add_argument("--album-size", type=int, default=10)
+    parser.add_argument("--reply-ratio", type=float, default=0.2)
+    parser.add_argument("--edit-ratio", type=float, default=0.1)
+    parser.add_argument("--latency", type=float, default=0.05, help="mean Bot API latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.02)
+    parser.add_argument("--rate-429", type=float, default=0.0, help="share of message calls answered with 429")
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--rate-5xx", type=float, default=0.0, help="share of message calls answered with 502")
+    parser.add_argument("--no-spawn", action="store_true", help="do not start the bot, it is run separately")
+    parser.add_argument("--seed", type=int, default=1)
+    return parser.parse_args()
+
+
+def bot_environment(args, channels, workdir):
+    env = dict(os.environ)
+    env.update({
+        "API_TOKEN": "123456:loadtest",
+        "API_ID": "1",
+        "API_HASH": "loadtest",
+        "BOT_API_BASE_URL": f"http://127.0.0.1:{args.port}/bot",
+        "TELETHON_ENABLED": "0",
+        "SHARD_GROUPS": ",".join(str(channel) for channel in channels),
+        "DB_PATH": os.path.join(workdir, "message_mapping.db"),
+    })
+    return env
+
+
+def percentile(values, p):
+    if not values:
+        return float('nan')
+    return values[min(len(values) - 1, int(p * len(values)))]
+
+
+async def inject(api, args, channels):
+    """Inject posts at ``args.rate`` per second for ``args.duration`` seconds."""
+    last_post = {}
+    text_posts = []
+    albums = 0
+    deadline = time.monotonic() + args.duration
+    next_at = time.monotonic()
+    while time.monotonic() < deadline:
+        channel = random.choice(channels)
+        roll = random.random()
+        if roll < args.album_ratio:
+            albums += 1
+            for _ in range(args.album_size):
+                last_post[channel] = api.post(channel, media_group_id=f"album{albums}")
+                await asyncio.sleep(0.01)
+        elif roll < args.album_ratio + args.edit_ratio and text_posts:
+            api.edit(*random.choice(text_posts), text="edited https://x.com/e/1")
+        else:
+            reply_to = last_post.get(channel) if random.random() < args.reply_ratio else None
+            message_id = api.post(channel, text="post https://x.com/a/1", reply_to=reply_to)
+            last_post[channel] = message_id
+            text_posts.append((channel, message_id))
+        # Exponential gaps make arrivals bursty like real traffic
+        next_at += random.expovariate(args.rate)
+        await asyncio.sleep(max(0.0, next_at - time.monotonic()))
+
+
+def mirrored(api, peers_of):
+    return sum(
+        1 for source in api.injected
+        if len(api.copies.get(source, ())) >= len(peers_of[source[0]])
+    )
+
+
+def report(api, peers_of, elapsed):
+    latencies = sorted(latency for copies in api.copies.values() for latency in copies.values())
+    complete = mirrored(api, peers_of)
+    print()
+    print(f"Posts injected: {len(api.injected)}, fully mirrored: {complete}, missing: {len(api.injected) - complete}")
+    print(f"Copies: {len(latencies)} in {elapsed:.1f}s ({len(latencies) / elapsed:.1f}/s)")
+    print("End-to-end latency ms: p50 {:.0f}, p95 {:.0f}, p99 {:.0f}, max {:.0f}".format(
+        *(percentile(latencies, p) * 1000 for p in (0.5, 0.95, 0.99, 1.0))
+    ))
+    print("Bot API calls:")
+    for (method, outcome), count in sorted(api.calls.items()):
+        print(f"  {method:<22} {outcome:<4} {count:>8}")
+
+
+async def run(args):
+    channels = [-1001000000001 - i for i in range(args.channels)]
+    peers_of = {channel: [peer for peer in channels if peer != channel] for channel in channels}
+    api = FakeBotApi(args.latency, args.jitter, args.rate_429, args.retry_after, args.rate_5xx)
+    runner = web.AppRunner(api.app(), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", args.port).start()
+    print(f"Fake Bot API listening on http://127.0.0.1:{args.port}/bot<token>/<method>")
+
+    bot = None
+    workdir = tempfile.mkdtemp(prefix="anon-sharding-loadtest-")
+    if not args.no_spawn:
+        bot = await asyncio.create_subprocess_exec(
+            sys.executable, os.path.join(ROOT, "main_ptb.py"),
+            cwd=workdir,
+            env=bot_environment(args, channels, workdir),
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.DEVNULL,
+        )
+        print(f"Started bot (pid {bot.pid}), logs in {workdir}")
+
+    try:
+        start = time.monotonic()
+        injection = asyncio.create_task(inject(api, args, channels))
+        drain_deadline = None
+        while True:
+            await asyncio.sleep(5 if not injection.done() else 1)
+            complete = mirrored(api, peers_of)
+            print(f"[{time.monotonic() - start:6.0f}s] injected {len(api.injected)}, mirrored {complete}, "
+                  f"queued updates {api.pending_updates()}")
+            if bot is not None and bot.returncode is not None:
+                print(f"Bot exited with code {bot.returncode}")
+                break
+            if injection.done():
+                drain_deadline = drain_deadline or time.monotonic() + args.drain
+                if complete == len(api.injected) or time.monotonic() > drain_deadline:
+                    break
+        await injection
+        report(api, peers_of, time.monotonic() - start)
+    finally:
+        if bot is not None and bot.returncode is None:
+            bot.send_signal(signal.SIGINT)
+            try:
+                await asyncio.wait_for(bot.wait(), 30)
+            except asyncio.TimeoutError:
+                bot.kill()
+        await runner.cleanup()
+
+
+def main():
+    args = parse_args()
+    random.seed(args.seed)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
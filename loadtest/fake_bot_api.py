@@ -0,0 +1,221 @@
+import asyncio
+import itertools
+import json
+import random
+import re
+import time
+
+from aiohttp import web
+
+# Methods that send or edit messages, only these get latency and errors injected
+MESSAGE_METHODS = {
+    'sendMessage', 'copyMessage', 'copyMessages', 'forwardMessage', 'forwardMessages', 'sendMediaGroup',
+    'editMessageText', 'editMessageCaption',
+}
+
+MARKER = re.compile(r"lt:(-?\d+):(\d+)")
+
+
+def _parse(value):
+    try:
+        return json.loads(value)
+    except (TypeError, ValueError):
+        return value
+
+
+class FakeBotApi:
+    """Local stand-in for the Telegram Bot API, serving ``/bot<token>/<method>``.
+
+    Channel posts are injected with ``post`` and handed out by getUpdates long polling.
+    Message methods answer after ``latency`` (+- ``jitter``) seconds, and fail with a
+    429 RetryAfter or a 502 at the given rates. Copies are traced back to the injected
+    post through a ``lt:<chat>:<message>`` marker in texts and file IDs, or the source of
+    copies and forwards, to measure end-to-end mirroring latency.
+    """
+
+    def __init__(self, latency=0.05, jitter=0.02, rate_429=0.0, retry_after=1, rate_5xx=0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+        self.rate_5xx = rate_5xx
+        self.calls = {}
+        self.injected = {}
+        # (source chat, source message) -> {target chat: seconds from injection to copy}
+        self.copies = {}
+        self._updates = []
+        self._update_ids = itertools.count(1)
+        self._message_ids = {}
+        self._new_updates = asyncio.Event()
+
+    def app(self):
+        app = web.Application()
+        app.router.add_route('*', r'/bot{token}/{method}', self._handle)
+        return app
+
+    # Update injection
+    def next_message_id(self, chat_id):
+        self._message_ids.setdefault(chat_id, itertools.count(1))
+        return next(self._message_ids[chat_id])
+
+    def post(self, chat_id, text=None, media_group_id=None, reply_to=None):
+        """Inject a channel post, a photo when ``text`` is None, and return its message ID."""
+        message_id = self.next_message_id(chat_id)
+        marker = f"lt:{chat_id}:{message_id}"
+        message = self._message(chat_id, message_id)
+        if text is None:
+            message['photo'] = [{'file_id': marker, 'file_unique_id': marker, 'width': 1280, 'height': 720}]
+            message['caption'] = f"photo {marker}"
+        else:
+            message['text'] = f"{text} {marker}"
+        if media_group_id:
+            message['media_group_id'] = media_group_id
+        if reply_to:
+            message['reply_to_message'] = dict(self._message(chat_id, reply_to), text="replied")
+        self.injected[(chat_id, message_id)] = time.monotonic()
+        self._push({'channel_post': message})
+        return message_id
+
+    def edit(self, chat_id, message_id, text):
+        message = dict(self._message(chat_id, message_id), text=f"{text} lt:{chat_id}:{message_id}")
+        message['edit_date'] = int(time.time())
+        self._push({'edited_channel_post': message})
+
+    def pending_updates(self):
+        return len(self._updates)
+
+    def _push(self, update):
+        update['update_id'] = next(self._update_ids)
+        self._updates.append(update)
+        self._new_updates.set()
+
+    @staticmethod
+    def _message(chat_id, message_id, **fields):
+        return dict(
+            message_id=message_id,
+            date=int(time.time()),
+            chat={'id': chat_id, 'type': 'channel', 'title': f"channel {chat_id}"},
+            **fields
+        )
+
+    # HTTP
+    async def _handle(self, request):
+        method = request.match_info['method']
+        params = {}
+        if request.content_type == 'application/json':
+            params = await request.json()
+        else:
+            params = {key: _parse(value) for key, value in (await request.post()).items()}
+
+        if method in MESSAGE_METHODS:
+            delay = self.latency + random.uniform(-self.jitter, self.jitter)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            roll = random.random()
+            if roll < self.rate_429:
+                self._count(method, '429')
+                return web.json_response({
+                    'ok': False,
+                    'error_code': 429,
+                    'description': f"Too Many Requests: retry after {self.retry_after}",
+                    'parameters': {'retry_after': self.retry_after},
+                }, status=429)
+            if roll < self.rate_429 + self.rate_5xx:
+                self._count(method, '502')
+                return web.json_response({'ok': False, 'error_code': 502, 'description': "Bad Gateway"}, status=502)
+
+        handler = getattr(self, f"_method_{method}", None)
+        if handler is None:
+            self._count(method, '404')
+            return web.json_response({'ok': False, 'error_code': 404, 'description': "Not Found"}, status=404)
+        self._count(method, 'ok')
+        return web.json_response({'ok': True, 'result': await handler(params)})
+
+    def _count(self, method, outcome):
+        self.calls[(method, outcome)] = self.calls.get((method, outcome), 0) + 1
+
+    def _record_copy(self, source, target_chat):
+        injected_at = self.injected.get(source)
+        if injected_at is not None:
+            self.copies.setdefault(source, {}).setdefault(target_chat, time.monotonic() - injected_at)
+
+    def _record_marked_copy(self, text, target_chat):
+        match = MARKER.search(str(text or ""))
+        if match:
+            self._record_copy((int(match.group(1)), int(match.group(2))), target_chat)
+
+    # Bot API methods
+    async def _method_getMe(self, params):
+        return {'id': 1, 'is_bot': True, 'first_name': "Load test bot", 'username': "load_test_bot",
+                'can_join_groups': True, 'can_read_all_group_messages': False, 'supports_inline_queries': False}
+
+    async def _method_deleteWebhook(self, params):
+        return True
+
+    async def _method_setWebhook(self, params):
+        return True
+
+    async def _method_getUpdates(self, params):
+        offset = int(params.get('offset') or 0)
+        limit = int(params.get('limit') or 100)
+        timeout = float(params.get('timeout') or 0)
+        # Updates below the offset have been confirmed by the bot
+        self._updates = [update for update in self._updates if update['update_id'] >= offset]
+        if not self._updates and timeout:
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self._updates[:limit]
+
+    async def _method_sendMessage(self, params):
+        chat_id = int(params['chat_id'])
+        self._record_marked_copy(params.get('text'), chat_id)
+        return self._message(chat_id, self.next_message_id(chat_id), text=str(params.get('text', "")))
+
+    async def _method_copyMessage(self, params):
+        chat_id = int(params['chat_id'])
+        self._record_copy((int(params['from_chat_id']), int(params['message_id'])), chat_id)
+        return {'message_id': self.next_message_id(chat_id)}
+
+    async def _method_forwardMessage(self, params):
+        chat_id = int(params['chat_id'])
+        self._record_copy((int(params['from_chat_id']), int(params['message_id'])), chat_id)
+        return self._message(chat_id, self.next_message_id(chat_id), text="forwarded")
+
+    async def _method_copyMessages(self, params):
+        return self._copy_messages(params)
+
+    async def _method_forwardMessages(self, params):
+        return self._copy_messages(params)
+
+    def _copy_messages(self, params):
+        chat_id = int(params['chat_id'])
+        from_chat_id = int(params['from_chat_id'])
+        message_ids = params['message_ids'] if isinstance(params['message_ids'], list) else json.loads(params['message_ids'])
+        copied = []
+        for message_id in message_ids:
+            self._record_copy((from_chat_id, int(message_id)), chat_id)
+            copied.append({'message_id': self.next_message_id(chat_id)})
+        return copied
+
+    async def _method_sendMediaGroup(self, params):
+        chat_id = int(params['chat_id'])
+        media = params['media'] if isinstance(params['media'], list) else json.loads(params['media'])
+        sent = []
+        for item in media:
+            self._record_marked_copy(item.get('media'), chat_id)
+            sent.append(self._message(
+                chat_id, self.next_message_id(chat_id),
+                photo=[{'file_id': item.get('media'), 'file_unique_id': "copy", 'width': 1280, 'height': 720}],
+            ))
+        return sent
+
+    async def _method_editMessageText(self, params):
+        chat_id = int(params['chat_id'])
+        return self._message(chat_id, int(params['message_id']), text=str(params.get('text', "")))
+
+    async def _method_editMessageCaption(self, params):
+        chat_id = int(params['chat_id'])
+        return self._message(chat_id, int(params['message_id']), caption=str(params.get('caption', "")))
@@ -1,23 +1,73 @@
+import atexit
 import logging
+import logging.handlers
+import os
+import queue
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Level of the bridge logger, and of every subsystem without its own level
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# Per-subsystem levels, e.g. LOG_LEVELS="storage=DEBUG,outbound=WARNING"
+LOG_LEVELS = os.getenv("LOG_LEVELS", "")
+# Log file, empty to log to the console only
+LOG_FILE = os.getenv("LOG_FILE", "example.log")
+# The log file is rotated once it reaches LOG_MAX_BYTES, or at LOG_ROTATE_WHEN (e.g. "midnight") if set
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", 10 * 1024 * 1024))
+LOG_ROTATE_WHEN = os.getenv("LOG_ROTATE_WHEN")
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", 5))
 
 logger = logging.getLogger(__name__)
 
-# Create a file handler
-file_handler = logging.FileHandler('example.log', encoding='utf-8')
-file_handler.setLevel(logging.INFO)
 
-# Create a console handler
-console_handler = logging.StreamHandler()
-console_handler.setLevel(logging.INFO)
+def get_logger(subsystem):
+    """Logger of a subsystem, its level can be set on its own through LOG_LEVELS."""
+    return logger.getChild(subsystem)
+
+
+def parse_log_levels(spec):
+    """Parse "subsystem=LEVEL,subsystem=LEVEL" into a dict of subsystem -> level name."""
+    levels = {}
+    for entry in spec.split(','):
+        if entry.strip():
+            subsystem, _, level = entry.partition('=')
+            levels[subsystem.strip()] = level.strip().upper()
+    return levels
 
-# Create a formatter and add it to the handlers
+
+# Create a formatter for the handlers
 formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-file_handler.setFormatter(formatter)
+
+# Create a console handler
+console_handler = logging.StreamHandler()
 console_handler.setFormatter(formatter)
+handlers = [console_handler]
+
+# Create a rotating file handler
+if LOG_FILE:
+    if LOG_ROTATE_WHEN:
+        file_handler = logging.handlers.TimedRotatingFileHandler(
+            LOG_FILE, when=LOG_ROTATE_WHEN, backupCount=LOG_BACKUP_COUNT, encoding='utf-8'
+        )
+    else:
+        file_handler = logging.handlers.RotatingFileHandler(
+            LOG_FILE, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding='utf-8'
+        )
+    file_handler.setFormatter(formatter)
+    handlers.append(file_handler)
+
+# The logging call only formats the message and queues the record, a background thread writes it out
+log_queue = queue.SimpleQueue()
+listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+listener.start()
+atexit.register(listener.stop)
 
-# Add the handlers to the logger
-logger.addHandler(file_handler)
-logger.addHandler(console_handler)
+# Add the queue handler to the logger
+logger.addHandler(logging.handlers.QueueHandler(log_queue))
 
-# Set the logger level
-logger.setLevel(logging.INFO)
+# Set the logger levels
+logger.setLevel(LOG_LEVEL)
+for subsystem, level in parse_log_levels(LOG_LEVELS).items():
+    get_logger(subsystem).setLevel(level)
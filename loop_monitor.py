@@ -0,0 +1,120 @@
+import asyncio
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+import traceback
+
+from log import get_logger
+from metrics import Histogram
+
+logger = get_logger("loop_monitor")
+
+LOOP_LAG_SECONDS = Histogram(
+    "bridge_event_loop_lag_seconds",
+    "Delay of the event loop heartbeat beyond its scheduled time.",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+
+
+class LoopWatchdog:
+    """Detects event loop stalls and logs what the loop thread was doing.
+
+    A heartbeat task on the loop records a timestamp every ``interval`` seconds, and its
+    lateness is recorded as loop lag. A watcher thread checks the heartbeat; once it is
+    more than ``threshold`` seconds old the loop is blocked, and the stack of the loop
+    thread is logged, once per stall.
+    """
+
+    def __init__(self, interval=0.1, threshold=0.25):
+        self.interval = interval
+        self.threshold = threshold
+        self._last_beat = time.monotonic()
+        self._loop = None
+        self._loop_thread_id = None
+        self._task = None
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._task = self._loop.create_task(self._heartbeat())
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+        logger.info("Event loop watchdog started, reporting stalls over %ss", self.threshold)
+
+    def stop(self):
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _heartbeat(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            LOOP_LAG_SECONDS.observe(max(0.0, now - expected))
+            self._last_beat = now
+
+    def _watch(self):
+        reported_beat = None
+        while not self._stopped.wait(self.interval):
+            last_beat = self._last_beat
+            stalled_for = time.monotonic() - last_beat
+            if stalled_for > self.threshold and last_beat != reported_beat:
+                reported_beat = last_beat
+                self._report(stalled_for)
+
+    def _report(self, stalled_for):
+        frame = sys._current_frames().get(self._loop_thread_id)
+        if frame is None:
+            return
+        stack = "".join(traceback.format_stack(frame))
+        try:
+            task = asyncio.current_task(self._loop)
+        except RuntimeError:
+            task = None
+        task_name = task.get_coro().__qualname__ if task is not None else "no task"
+        logger.warning("Event loop blocked for %.3fs in %s, loop thread stack:\n%s", stalled_for, task_name, stack)
+
+
+class Profiler:
+    """Profiles the event loop thread with cProfile for a fixed time on request.
+
+    The profile is written to ``directory`` for ``pstats`` or snakeviz, and the most
+    expensive functions are logged. Only one profile runs at a time.
+    """
+
+    def __init__(self, seconds=30, directory=".", top=30):
+        self.seconds = seconds
+        self.directory = directory
+        self.top = top
+        self._profile = None
+
+    def start(self):
+        """Start profiling, must be called on the event loop thread."""
+        if self._profile is not None:
+            logger.info("Profiler is already running")
+            return
+        self._profile = cProfile.Profile()
+        self._profile.enable()
+        asyncio.get_running_loop().call_later(self.seconds, self._finish)
+        logger.info("Profiling the event loop for %ss", self.seconds)
+
+    def _finish(self):
+        profile, self._profile = self._profile, None
+        profile.disable()
+        path = os.path.join(self.directory, f"profile-{time.strftime('%Y%m%d-%H%M%S')}.prof")
+        try:
+            profile.dump_stats(path)
+        except OSError as e:
+            logger.error("Failed to write profile to %s: %s", path, e)
+            path = None
+        summary = io.StringIO()
+        pstats.Stats(profile, stream=summary).sort_stats("cumulative").print_stats(self.top)
+        logger.info("Profile written to %s:\n%s", path, summary.getvalue())
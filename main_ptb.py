@@ -1,41 +1,38 @@
-import sqlite3
 import json
 import time
 import asyncio
 import os
-import re
 from dotenv import load_dotenv
 from log import logger
+from storage import Storage
+from mapping_cache import MappingCache
+from reaction_scheduler import ReactionPollScheduler, parse_tiers
+from edit_queue import EditQueue
+from reactions import ID_TO_CUSTOM_EMOJI_MAP, ReactionState, encode_reaction, decode_reaction
+from media_groups import MediaGroupCollector
+from links import LinkRewriter, DEFAULT_LINK_RULES, parse_link_rules
+from shards import ShardGroups, parse_shard_groups, fan_out
+from webhook import WebhookServer
+from update_processor import KeyedUpdateProcessor
+from metrics import MetricsServer, Gauge, timed, STAGE_SECONDS, TELETHON_CALLS, FALLBACKS
+from loop_monitor import LoopWatchdog, Profiler
+from retention import archive_mappings, find_stale_reactions, prune_reactions, incremental_vacuum
+from outbound import OutboundScheduler, PRIORITY_POST, PRIORITY_REACTION, PRIORITY_BACKFILL, retry_after_seconds
+import signal
 import traceback
 
 # Python-telegram-bot imports
-from telegram import Update, Message, Bot
+from telegram import Update, Message, Bot, MessageEntity
 from telegram.ext import Application, MessageHandler, filters, ContextTypes, CallbackContext
 from telegram.constants import ParseMode
+from telegram.error import RetryAfter
 
 # Telethon imports (still needed for reactions)
-from telethon import TelegramClient
-from telethon.tl.types import PeerChannel
+from telethon import TelegramClient, events, errors
+from telethon.extensions import html
+from telethon.tl.types import PeerChannel, UpdateMessageReactions, UpdateEditChannelMessage, MessageMediaWebPage
 from telethon.tl.functions.messages import GetMessagesReactionsRequest
 
-CUSTOM_EMOJI_TO_ID_MAP = {
-    '(B)': 5224647090734375337,
-    '[токнау]': 5307977565175029928,
-    '(токнау)': 5305776162507596250,
-    '𝕋𝕒𝕝': 5307935766553304360,
-    '𝕜ℕ': 5305747476421027973,
-    '𝕠𝕨': 5305495104142713367,
-    '𝐓𝐚𝐥': 5307801694854191826,
-    '𝐤𝐍': 5308050107172659858,
-    '𝐨𝐰': 5305459232575857422,
-    'юрец': 5307972372559568260,
-    'гол': 5262944983400334596,
-    'гоол': 5262983208609269585,
-    'гооол': 5263001522349819939,
-    'натер': 4978814394050806930,
-}
-ID_TO_CUSTOM_EMOJI_MAP = {v:k for k,v in CUSTOM_EMOJI_TO_ID_MAP.items()}
-
 # Load environment variables
 load_dotenv(".env")
 
@@ -44,97 +41,647 @@ API_TOKEN = os.getenv("API_TOKEN")
 API_ID = int(os.getenv("API_ID"))
 API_HASH = os.getenv("API_HASH")
 PHONE_NUMBER = os.getenv("PHONE_NUMBER")
-MESSAGE_CHECK_FOR_REACTIONS_LIMIT = int(os.getenv("MESSAGE_CHECK_FOR_REACTIONS_LIMIT", 100))
+# Bot API endpoint the token is appended to, e.g. http://127.0.0.1:8081/bot for a local or fake server
+BOT_API_BASE_URL = os.getenv("BOT_API_BASE_URL", "https://api.telegram.org/bot")
+# Reactions are read through Telethon, without it only posts and edits are mirrored
+TELETHON_ENABLED = os.getenv("TELETHON_ENABLED", "1") == "1"
+REACTION_UPDATES_ENABLED = os.getenv("REACTION_UPDATES_ENABLED", "1") == "1"
+# Reaction polling intervals by message age, as "max_age:interval" pairs in seconds.
+# With push updates enabled polling only reconciles missed updates, so it runs less often.
+REACTION_POLL_TIERS = parse_tiers(os.getenv(
+    "REACTION_POLL_TIERS",
+    "3600:60,86400:600,604800:3600,inf:21600" if REACTION_UPDATES_ENABLED else "3600:10,86400:120,604800:1800,inf:14400"
+))
+REACTION_POLL_ACTIVE_WINDOW = int(os.getenv("REACTION_POLL_ACTIVE_WINDOW", 600))
+# Messages with recent reaction activity are polled this often, pushed updates already cover them when enabled
+REACTION_POLL_ACTIVE_INTERVAL = int(os.getenv("REACTION_POLL_ACTIVE_INTERVAL", 60 if REACTION_UPDATES_ENABLED else 5))
+REACTION_POLL_BUDGET = int(os.getenv("REACTION_POLL_BUDGET", 5))
+REACTION_POLL_TICK = float(os.getenv("REACTION_POLL_TICK", 2))
+REACTION_POLL_MAX_MESSAGES = int(os.getenv("REACTION_POLL_MAX_MESSAGES", 50000))
+REACTION_POLL_MAX_AGE_DAYS = int(os.getenv("REACTION_POLL_MAX_AGE_DAYS", 30))
+# GetMessagesReactions accepts up to 100 message IDs per request
+REACTION_FETCH_BATCH_SIZE = int(os.getenv("REACTION_FETCH_BATCH_SIZE", 100))
+# copyMessages and forwardMessages accept up to 100 message IDs per request
+BATCH_COPY_SIZE = int(os.getenv("BATCH_COPY_SIZE", 100))
+# Reaction counts live in memory and are written to the database in batches this often, in seconds
+REACTION_FLUSH_INTERVAL = float(os.getenv("REACTION_FLUSH_INTERVAL", 5))
+# Bot API rate limits, Telegram allows about 30 messages per second overall and 1 per second per chat
+OUTBOUND_GLOBAL_RATE = float(os.getenv("OUTBOUND_GLOBAL_RATE", 25))
+OUTBOUND_CHAT_RATE = float(os.getenv("OUTBOUND_CHAT_RATE", 1))
+OUTBOUND_CHAT_BURST = int(os.getenv("OUTBOUND_CHAT_BURST", 3))
+OUTBOUND_MAX_RETRIES = int(os.getenv("OUTBOUND_MAX_RETRIES", 5))
+# Edits of the same message submitted within this many seconds are merged into one
+EDIT_DEBOUNCE = float(os.getenv("EDIT_DEBOUNCE", 1.0))
+# Albums are sent once no item arrived for the quiet gap, at most the max wait after their first item
+MEDIA_GROUP_QUIET_GAP = float(os.getenv("MEDIA_GROUP_QUIET_GAP", 0.5))
+MEDIA_GROUP_MAX_WAIT = float(os.getenv("MEDIA_GROUP_MAX_WAIT", 3.0))
+MEDIA_GROUP_MAX_GROUPS = int(os.getenv("MEDIA_GROUP_MAX_GROUPS", 100))
+# Telegram albums hold up to 10 items
+MEDIA_GROUP_MAX_ITEMS = int(os.getenv("MEDIA_GROUP_MAX_ITEMS", 10))
+# Posts still in the outbox at startup are replayed this many at a time, and given up after
+# this many replays
+OUTBOX_REPLAY_CONCURRENCY = int(os.getenv("OUTBOX_REPLAY_CONCURRENCY", 4))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", 3))
+# Posts published while the bridge was offline are copied once Telethon is connected, after
+# BACKFILL_DELAY seconds so that polling first delivers the updates Telegram still holds
+BACKFILL_ENABLED = os.getenv("BACKFILL_ENABLED", "1") == "1"
+BACKFILL_DELAY = float(os.getenv("BACKFILL_DELAY", 10))
+BACKFILL_CONCURRENCY = int(os.getenv("BACKFILL_CONCURRENCY", 2))
+# Every RETENTION_INTERVAL seconds mappings older than RETENTION_MAPPING_DAYS are archived
+# and the bodies of their messages deleted, reactions not updated for RETENTION_REACTION_DAYS are deleted and the freed space is
+# returned to the file system. 0 disables the job or keeps those rows forever.
+RETENTION_INTERVAL = float(os.getenv("RETENTION_INTERVAL", 3600))
+RETENTION_MAPPING_DAYS = int(os.getenv("RETENTION_MAPPING_DAYS", 180))
+RETENTION_REACTION_DAYS = int(os.getenv("RETENTION_REACTION_DAYS", 60))
+RETENTION_CHUNK_ROWS = int(os.getenv("RETENTION_CHUNK_ROWS", 1000))
+VACUUM_CHUNK_PAGES = int(os.getenv("VACUUM_CHUNK_PAGES", 256))
+# Maximum number of channels a single post is copied to at the same time
+FANOUT_CONCURRENCY = int(os.getenv("FANOUT_CONCURRENCY", 4))
+MAPPING_CACHE_SIZE = int(os.getenv("MAPPING_CACHE_SIZE", 20000))
+MAPPING_CACHE_WARM_ROWS = int(os.getenv("MAPPING_CACHE_WARM_ROWS", 5000))
+
+# Updates are received by long polling, or pushed by Telegram to an embedded server with
+# BOT_MODE=webhook. WEBHOOK_URL is the public URL Telegram posts to, it must end in WEBHOOK_PATH
+# unless a reverse proxy rewrites it.
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", 8443))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+# Updates received but not yet handled, webhook requests get 503 while it is full
+UPDATE_QUEUE_SIZE = int(os.getenv("UPDATE_QUEUE_SIZE", 1000))
+# Updates of different channels are handled concurrently up to this many at once,
+# updates of one channel always one after another
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", 8))
+# How long edits and replies wait for the post they refer to to be mirrored
+PENDING_POST_TIMEOUT = float(os.getenv("PENDING_POST_TIMEOUT", 30))
+
+# Links to these hosts are rewritten to embed-friendly mirrors, "host=replacement,host=replacement,..."
+LINK_REWRITE_RULES = parse_link_rules(os.getenv("LINK_REWRITE_RULES", DEFAULT_LINK_RULES))
+
+# Prometheus metrics are served on this local port, 0 disables them
+METRICS_LISTEN = os.getenv("METRICS_LISTEN", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", 9464))
+
+# Event loop stalls longer than the threshold are logged with the loop thread's stack, 0 disables it
+LOOP_WATCHDOG_INTERVAL = float(os.getenv("LOOP_WATCHDOG_INTERVAL", 0.1))
+LOOP_WATCHDOG_THRESHOLD = float(os.getenv("LOOP_WATCHDOG_THRESHOLD", 0.25))
+# SIGUSR1 profiles the event loop for PROFILE_SECONDS, PROFILE_ON_START=1 does so right after startup
+PROFILE_SECONDS = float(os.getenv("PROFILE_SECONDS", 30))
+PROFILE_DIR = os.getenv("PROFILE_DIR", ".")
+PROFILE_ON_START = os.getenv("PROFILE_ON_START", "0") == "1"
 
-# Channel configurations
-channel1 = os.getenv("CHANNEL1")
-channel2 = os.getenv("CHANNEL2")
-channel1_telethon = int(channel1[4:])
-channel2_telethon = int(channel2[4:])
+# Channel configurations: groups of channels whose posts are copied to every other member,
+# e.g. SHARD_GROUPS="-1001,-1002,-1003;-1004,-1005". Without it CHANNEL1 and CHANNEL2 form one group.
+SHARD_GROUPS = os.getenv("SHARD_GROUPS")
+if SHARD_GROUPS:
+    shard_groups = ShardGroups(parse_shard_groups(SHARD_GROUPS))
+else:
+    shard_groups = ShardGroups([(int(os.getenv("CHANNEL1")), int(os.getenv("CHANNEL2")))])
+telethon_channels = {int(str(channel_id)[4:]) for channel_id in shard_groups.channels}
 
-if isinstance(channel1, str) and isinstance(channel2, str):
-    channel1, channel2 = int(channel1), int(channel2)
+# All link rules compiled into one matcher
+link_rewriter = LinkRewriter(LINK_REWRITE_RULES)
+
+# Bounds the number of copies in flight across all posts
+fanout_semaphore = asyncio.Semaphore(FANOUT_CONCURRENCY)
 
 # Initialize Telethon client (still needed for reaction handling)
 telethon_client = TelegramClient('telethon_session', API_ID, API_HASH)
 
-# Connect to SQLite database
-conn = sqlite3.connect('message_mapping.db')
-cursor = conn.cursor()
+# SQLite database, owned by a background thread so that commits never block the event loop
+DB_PATH = os.getenv("DB_PATH", "message_mapping.db")
+DB_COMMIT_WINDOW = float(os.getenv("DB_COMMIT_WINDOW", 0.02))
+# Mappings older than RETENTION_MAPPING_DAYS are moved to this database, it is still used for lookups.
+# It sits next to DB_PATH by default and must be kept on the same persistent volume.
+ARCHIVE_DB_PATH = os.getenv("ARCHIVE_DB_PATH", os.path.splitext(DB_PATH)[0] + "_archive.db")
+storage = Storage(DB_PATH, commit_window=DB_COMMIT_WINDOW, archive_path=ARCHIVE_DB_PATH)
+
+# Recent mappings are kept in memory, nearly every lookup targets the newest posts
+mapping_cache = MappingCache(MAPPING_CACHE_SIZE)
+
+# All Bot API calls go through one rate-limited scheduler, new posts before edits
+outbound = OutboundScheduler(
+    global_rate=OUTBOUND_GLOBAL_RATE,
+    chat_rate=OUTBOUND_CHAT_RATE,
+    chat_burst=OUTBOUND_CHAT_BURST,
+    max_retries=OUTBOUND_MAX_RETRIES,
+)
+
+# All message edits go through a coalescing queue
+edit_queue = EditQueue(outbound, debounce=EDIT_DEBOUNCE)
 
-# Create tables if they don't exist
-cursor.execute('''CREATE TABLE IF NOT EXISTS message_mapping
-                (original_channel INTEGER, original_id INTEGER, copied_channel INTEGER, copied_id INTEGER)''')
+# Posts that are being mirrored, (channel, message ID) -> future resolved once their mappings are stored
+pending_posts = {}
 
-cursor.execute('''CREATE TABLE IF NOT EXISTS message_reactions
-                (channel_id INTEGER, 
-                 message_id INTEGER, 
-                 reaction_data TEXT,
-                 last_updated INTEGER,
-                 PRIMARY KEY (channel_id, message_id))''')
+# Albums are collected here until complete
+media_groups = MediaGroupCollector(
+    lambda group: flush_media_group(group),
+    quiet_gap=MEDIA_GROUP_QUIET_GAP,
+    max_wait=MEDIA_GROUP_MAX_WAIT,
+    max_groups=MEDIA_GROUP_MAX_GROUPS,
+    max_items=MEDIA_GROUP_MAX_ITEMS,
+)
+
+# Every mapped message gets its own reaction polling schedule
+reaction_scheduler = ReactionPollScheduler(
+    REACTION_POLL_TIERS,
+    active_window=REACTION_POLL_ACTIVE_WINDOW,
+    active_interval=REACTION_POLL_ACTIVE_INTERVAL,
+    budget=REACTION_POLL_BUDGET,
+    batch_size=REACTION_FETCH_BATCH_SIZE,
+    max_age=REACTION_POLL_MAX_AGE_DAYS * 86400 if REACTION_POLL_MAX_AGE_DAYS else None,
+)
+
+# Reaction counts by Telethon (channel, message ID), loaded at startup and flushed in batches
+reaction_state = ReactionState()
+
+# Queue sizes, read whenever metrics are scraped
+Gauge("bridge_media_groups_pending", "Media groups being collected.", lambda: len(media_groups))
+Gauge("bridge_edit_queue_size", "Edits waiting to be sent.", lambda: len(edit_queue))
+Gauge("bridge_outbound_queue_size", "Bot API calls waiting for flood control.", lambda: len(outbound))
+Gauge("bridge_pending_posts", "Posts being mirrored.", lambda: len(pending_posts))
+Gauge("bridge_reaction_poll_messages", "Messages tracked by the reaction poll scheduler.", lambda: len(reaction_scheduler))
+Gauge("bridge_reaction_state_messages", "Messages with reaction counts held in memory.", lambda: len(reaction_state))
+Gauge("bridge_reaction_state_dirty", "Messages whose reaction counts are not yet written.", reaction_state.dirty_count)
 
 # Database helper functions
-def store_mapping(original_channel, original_id, copied_channel, copied_id):
-    cursor.execute("INSERT INTO message_mapping VALUES (?, ?, ?, ?)", (original_channel, original_id, copied_channel, copied_id))
-    conn.commit()
+async def store_mapping(original_channel, original_id, copied_channel, copied_id):
+    await store_mappings([(original_channel, original_id, copied_channel, copied_id)])
+
+async def store_mappings(mappings):
+    """Store several (original_channel, original_id, copied_channel, copied_id) rows in one transaction."""
+    created_at = int(time.time())
+    await storage.executemany(
+        "INSERT OR IGNORE INTO message_mapping (original_channel, original_id, copied_channel, copied_id, created_at) VALUES (?, ?, ?, ?, ?)",
+        [(*mapping, created_at) for mapping in mappings]
+    )
+    copies = {}
+    for original_channel, original_id, copied_channel, copied_id in mappings:
+        mapping_cache.add(original_channel, original_id, copied_channel, copied_id)
+        reaction_scheduler.add(to_telethon_channel(original_channel), original_id, created_at)
+        reaction_scheduler.add(to_telethon_channel(copied_channel), copied_id, created_at)
+        copies.setdefault((original_channel, original_id), []).append((copied_channel, copied_id))
+    # Copies of the same post correspond to each other through their original
+    for siblings in copies.values():
+        for i, (channel_a, id_a) in enumerate(siblings):
+            for channel_b, id_b in siblings[i + 1:]:
+                mapping_cache.add(channel_a, id_a, channel_b, id_b)
+
+async def warm_mapping_cache(limit=MAPPING_CACHE_WARM_ROWS):
+    """Load the most recently stored mappings into the in-memory cache."""
+    rows = await storage.fetchall(
+        "SELECT original_channel, original_id, copied_channel, copied_id FROM message_mapping ORDER BY rowid DESC LIMIT ?",
+        (limit,)
+    )
+    # Insert oldest first so the newest rows end up as the most recently used
+    for row in reversed(rows):
+        mapping_cache.add(*row)
+    logger.info("Warmed mapping cache with %s rows", len(rows))
 
-def get_original_id(original_channel, copied_id, copied_channel):
-    cursor.execute("SELECT original_id FROM message_mapping WHERE original_channel = ? AND copied_id = ? AND copied_channel = ?", (original_channel, copied_id, copied_channel))
-    result = cursor.fetchone()
+async def get_original_id(original_channel, copied_id, copied_channel):
+    result = await storage.fetchone("SELECT original_id FROM message_mapping WHERE original_channel = ? AND copied_id = ? AND copied_channel = ?", (original_channel, copied_id, copied_channel))
     return result[0] if result else None
 
-def get_copied_id(original_channel, original_id, copied_channel):
-    cursor.execute("SELECT copied_id FROM message_mapping WHERE original_channel = ? AND original_id = ? AND copied_channel = ?", (original_channel, original_id, copied_channel))
-    result = cursor.fetchone()
+async def get_copied_id(original_channel, original_id, copied_channel):
+    result = await storage.fetchone("SELECT copied_id FROM message_mapping WHERE original_channel = ? AND original_id = ? AND copied_channel = ?", (original_channel, original_id, copied_channel))
     return result[0] if result else None
 
-def get_corresponding_message_id(channel_id, message_id, target_channel):
+async def get_corresponding_message_id(channel_id, message_id, target_channel):
     """
-    Get the corresponding message ID in the target channel,
-    checking both directions in the database.
+    Get the corresponding message ID in the target channel with a single indexed query.
+    The message may be the original of the target message, its copy, or another copy of
+    the same original. Mappings of old posts are looked up in the archive on a miss.
     """
-    # First try as if this is the original message
-    corresponding_id = get_copied_id(channel_id, message_id, target_channel)
-    if corresponding_id:
-        logger.info(f"Found corresponding message as original->copy: {message_id}->{corresponding_id}")
-        return corresponding_id
-    
-    # Then try as if this is the copied message
-    corresponding_id = get_original_id(target_channel, message_id, channel_id)
-    if corresponding_id:
-        logger.info(f"Found corresponding message as copy->original: {message_id}->{corresponding_id}")
+    corresponding_id = mapping_cache.get(channel_id, message_id, target_channel)
+    if corresponding_id is not None:
         return corresponding_id
+
+    for table in ("message_mapping", "archive.message_mapping"):
+        result = await storage.fetchone(f"""
+            SELECT copied_id FROM {table}
+            WHERE original_channel = ? AND original_id = ? AND copied_channel = ?
+            UNION ALL
+            SELECT original_id FROM {table}
+            WHERE copied_channel = ? AND copied_id = ? AND original_channel = ?
+            UNION ALL
+            SELECT sibling.copied_id FROM {table} AS copy
+            JOIN {table} AS sibling
+                ON sibling.original_channel = copy.original_channel AND sibling.original_id = copy.original_id
+            WHERE copy.copied_channel = ? AND copy.copied_id = ? AND sibling.copied_channel = ?
+            LIMIT 1
+        """, (channel_id, message_id, target_channel, channel_id, message_id, target_channel,
+              channel_id, message_id, target_channel))
+        if result:
+            logger.debug("Found corresponding message: %s->%s", message_id, result[0])
+            mapping_cache.add(channel_id, message_id, target_channel, result[0])
+            return result[0]
     
     # No correspondence found
     return None
 
-def get_stored_reactions(channel_id, message_id):
-    """Get stored reactions for a message from the database."""
-    cursor.execute("SELECT reaction_data FROM message_reactions WHERE channel_id = ? AND message_id = ?", 
-                  (channel_id, message_id))
-    result = cursor.fetchone()
-    return json.loads(result[0]) if result else {}
+async def get_mirrored_messages(channel_id, message_id):
+    """Get (channel, message ID) of the same post in every other channel of its shard group."""
+    mirrored = []
+    for peer_channel in shard_groups.peers(channel_id):
+        peer_message_id = await get_corresponding_message_id(channel_id, message_id, peer_channel)
+        if peer_message_id is not None:
+            mirrored.append((peer_channel, peer_message_id))
+    return mirrored
+
+async def load_reaction_schedule():
+    """Schedule reaction polling for the most recently mapped messages."""
+    min_created_at = int(time.time()) - REACTION_POLL_MAX_AGE_DAYS * 86400 if REACTION_POLL_MAX_AGE_DAYS else 0
+    rows = await storage.fetchall("""
+        SELECT original_channel, original_id, copied_channel, copied_id, created_at FROM message_mapping
+        ORDER BY rowid DESC LIMIT ?
+    """, (REACTION_POLL_MAX_MESSAGES,))
+    for original_channel, original_id, copied_channel, copied_id, created_at in rows:
+        if created_at is not None and created_at < min_created_at:
+            continue
+        # Mappings stored before creation times were recorded are treated as old posts
+        posted_at = created_at or 0
+        reaction_scheduler.add(to_telethon_channel(original_channel), original_id, posted_at, jitter=True)
+        reaction_scheduler.add(to_telethon_channel(copied_channel), copied_id, posted_at, jitter=True)
+    logger.info("Scheduled reaction polling for %s messages", len(reaction_scheduler))
 
-def store_reactions(channel_id, message_id, reaction_data):
-    """Store reactions for a message in the database."""
-    reaction_json = json.dumps(reaction_data)
+async def load_reaction_state():
+    """Load every stored reaction count into memory."""
+    rows = await storage.fetchall("""
+        SELECT r.channel_id, r.message_id, r.fingerprint, c.reaction_code, c.count
+        FROM message_reactions r
+        LEFT JOIN reaction_counts c ON c.channel_id = r.channel_id AND c.message_id = r.message_id
+    """)
+    messages = {}
+    for channel_id, message_id, fingerprint, code, count in rows:
+        counts = messages.setdefault((channel_id, message_id), (fingerprint, {}))[1]
+        if code is not None:
+            counts[decode_reaction(code)] = count
+    for key, (fingerprint, counts) in messages.items():
+        reaction_state.load(key, counts, fingerprint)
+    logger.info("Loaded reactions of %s messages", len(messages))
+
+async def flush_reactions():
+    """Write the reaction counts changed since the last flush in one transaction."""
+    dirty = reaction_state.take_dirty()
+    if not dirty:
+        return
     current_time = int(time.time())
-    
-    cursor.execute("""
-        REPLACE INTO message_reactions 
-        (channel_id, message_id, reaction_data, last_updated) 
-        VALUES (?, ?, ?, ?)
-    """, (channel_id, message_id, reaction_json, current_time))
-    conn.commit()
-
-def reactions_changed(channel_id, message_id, current_reactions):
-    """Check if reactions have changed compared to what's stored in the database."""
-    stored_reactions = get_stored_reactions(channel_id, message_id)
-    
-    if stored_reactions is None:
-        return True
-    
-    return stored_reactions != current_reactions
+
+    def write(conn):
+        for (channel_id, message_id), counts, fingerprint in dirty:
+            conn.execute("DELETE FROM reaction_counts WHERE channel_id = ? AND message_id = ?", (channel_id, message_id))
+            conn.executemany(
+                "INSERT INTO reaction_counts (channel_id, message_id, reaction_code, count) VALUES (?, ?, ?, ?)",
+                [(channel_id, message_id, encode_reaction(reaction), count) for reaction, count in counts.items()]
+            )
+        conn.executemany("""
+            REPLACE INTO message_reactions
+            (channel_id, message_id, fingerprint, last_updated)
+            VALUES (?, ?, ?, ?)
+        """, [(channel_id, message_id, fingerprint, current_time) for (channel_id, message_id), _, fingerprint in dirty])
+
+    try:
+        await storage.write(write)
+    except Exception as e:
+        logger.error("Failed to flush reactions of %s messages, retrying later: %s", len(dirty), e)
+        reaction_state.mark_dirty(key for key, _, _ in dirty)
+
+async def flush_reactions_periodically():
+    while True:
+        await asyncio.sleep(REACTION_FLUSH_INTERVAL)
+        await flush_reactions()
+
+async def store_message_bodies(bodies):
+    """Store (channel_id, message_id, body) rows, where body is a dict built by get_canonical_body."""
+    await storage.executemany("""
+        INSERT INTO message_bodies (channel_id, message_id, body, entities, is_media)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (channel_id, message_id) DO UPDATE SET
+            body = excluded.body, entities = excluded.entities, is_media = excluded.is_media
+    """, [
+        (channel_id, message_id, body['text'],
+         json.dumps([entity.to_dict() for entity in body['entities']]) if body['entities'] else None,
+         int(body['is_media']))
+        for channel_id, message_id, body in bodies
+    ])
+
+async def get_message_body(channel_id, message_id):
+    """Get the stored canonical body of a message, or None if it was never stored."""
+    result = await storage.fetchone(
+        "SELECT body, entities, is_media, footer FROM message_bodies WHERE channel_id = ? AND message_id = ?",
+        (channel_id, message_id)
+    )
+    if not result:
+        return None
+    body, entities, is_media, footer = result
+    return {
+        'text': body or "",
+        'entities': MessageEntity.de_list(json.loads(entities)) if entities else (),
+        'is_media': bool(is_media),
+        'footer': footer or "",
+    }
+
+async def store_message_footer(channel_id, message_id, footer):
+    """Remember the reactions footer last rendered under a message."""
+    await storage.execute(
+        "UPDATE message_bodies SET footer = ? WHERE channel_id = ? AND message_id = ?",
+        (footer, channel_id, message_id)
+    )
+
+async def journal_posts(messages):
+    """
+    Record incoming posts in the outbox before mirroring them, so a crash cannot lose them.
+    The posts are pending until released.
+    """
+    created_at = int(time.time())
+    await storage.executemany(
+        "INSERT OR IGNORE INTO outbox (channel_id, message_id, payload, created_at) VALUES (?, ?, ?, ?)",
+        [(message.chat_id, message.message_id, message.to_json(), created_at) for message in messages]
+    )
+    loop = asyncio.get_running_loop()
+    for message in messages:
+        pending_posts.setdefault((message.chat_id, message.message_id), loop.create_future())
+
+async def complete_posts(posts):
+    """Remove mirrored posts, given as (channel, message ID) pairs, from the outbox."""
+    await storage.executemany("DELETE FROM outbox WHERE channel_id = ? AND message_id = ?", posts)
+
+async def complete_mirrored_posts(posts):
+    """Remove the posts that reached every channel of their shard group from the outbox, the others stay to be replayed."""
+    mirrored = [post for post in posts if not await get_unmirrored_channels(*post)]
+    if len(mirrored) < len(posts):
+        logger.warning("%s of %s posts were not copied to every channel, keeping them for replay",
+                       len(posts) - len(mirrored), len(posts))
+    await complete_posts(mirrored)
+
+def release_posts(posts):
+    """Mark posts, given as (channel, message ID) pairs, as no longer being mirrored."""
+    for post in posts:
+        future = pending_posts.pop(post, None)
+        if future is not None and not future.done():
+            future.set_result(None)
+
+async def wait_for_post(channel_id, message_id):
+    """Wait until the mappings of a post that is still being mirrored are stored."""
+    future = pending_posts.get((channel_id, message_id))
+    if future is None:
+        return
+    try:
+        await asyncio.wait_for(asyncio.shield(future), PENDING_POST_TIMEOUT)
+    except asyncio.TimeoutError:
+        logger.warning("Timed out waiting for message %s in channel %s to be mirrored", message_id, channel_id)
+
+async def get_unmirrored_channels(channel_id, message_id):
+    """Get the channels of the post's shard group it has not been copied to yet."""
+    unmirrored = []
+    for peer_channel in shard_groups.peers(channel_id):
+        if await get_corresponding_message_id(channel_id, message_id, peer_channel) is None:
+            unmirrored.append(peer_channel)
+    return tuple(unmirrored)
+
+async def replay_outbox(bot: Bot):
+    """Mirror the posts left unfinished in the outbox by the previous run."""
+    rows = await storage.fetchall(
+        "SELECT channel_id, message_id, payload, attempts FROM outbox ORDER BY created_at, message_id"
+    )
+    if not rows:
+        return
+    logger.info("Replaying %s unfinished posts from the outbox", len(rows))
+    await storage.execute("UPDATE outbox SET attempts = attempts + 1")
+
+    # Posts are replayed on their own, albums as a whole
+    jobs = {}
+    abandoned = []
+    for channel_id, message_id, payload, attempts in rows:
+        if attempts >= OUTBOX_MAX_ATTEMPTS:
+            abandoned.append((channel_id, message_id))
+            continue
+        message = Message.de_json(json.loads(payload), bot)
+        key = (channel_id, message.media_group_id or message_id)
+        jobs.setdefault(key, []).append(message)
+    if abandoned:
+        logger.warning("Giving up on %s posts that failed %s replays: %s", len(abandoned), OUTBOX_MAX_ATTEMPTS, abandoned)
+        await complete_posts(abandoned)
+
+    async def replay(key):
+        messages = jobs[key]
+        first_message = min(messages, key=lambda message: message.message_id)
+        # Channels the post already reached before the crash are skipped
+        target_channels = await get_unmirrored_channels(first_message.chat_id, first_message.message_id)
+        if not target_channels:
+            await complete_posts([(message.chat_id, message.message_id) for message in messages])
+        elif first_message.media_group_id:
+            await flush_media_group({
+                'group_id': first_message.media_group_id,
+                'items': [get_media_group_item(message) for message in messages],
+                'bot': bot,
+                'source_channel': first_message.chat_id,
+                'target_channels': target_channels,
+                'reply_to_message_id': first_message.reply_to_message.message_id if first_message.reply_to_message else None,
+            })
+        else:
+            await mirror_post(bot, first_message, target_channels)
+
+    results = await fan_out(asyncio.Semaphore(OUTBOX_REPLAY_CONCURRENCY), list(jobs), replay)
+    failed = [key for key, result in results.items() if isinstance(result, Exception)]
+    for key in failed:
+        logger.error("Failed to replay post %s from the outbox: %s", key, results[key])
+    logger.info("Replayed %s of %s posts and albums from the outbox", len(jobs) - len(failed), len(jobs))
+
+async def get_backfill_start(channel_id):
+    """Highest message ID of a channel that was mirrored or backfilled, None if the bridge never saw the channel."""
+    result = await storage.fetchone("""
+        SELECT MAX(message_id) FROM (
+            SELECT last_message_id AS message_id FROM backfill_state WHERE channel_id = ?
+            UNION ALL
+            SELECT MAX(original_id) FROM message_mapping WHERE original_channel = ?
+            UNION ALL
+            SELECT MAX(copied_id) FROM message_mapping WHERE copied_channel = ?
+            UNION ALL
+            SELECT MAX(original_id) FROM archive.message_mapping WHERE original_channel = ?
+            UNION ALL
+            SELECT MAX(copied_id) FROM archive.message_mapping WHERE copied_channel = ?
+        )
+    """, (channel_id,) * 5)
+    return result[0] if result else None
+
+async def get_backfill_starts():
+    """Backfill start of every channel, read before the bridge copies anything in this run."""
+    return {channel_id: await get_backfill_start(channel_id) for channel_id in shard_groups.channels}
+
+async def save_backfill_position(channel_id, message_id):
+    await storage.execute("""
+        INSERT INTO backfill_state (channel_id, last_message_id, updated_at) VALUES (?, ?, ?)
+        ON CONFLICT (channel_id) DO UPDATE SET
+            last_message_id = MAX(last_message_id, excluded.last_message_id), updated_at = excluded.updated_at
+    """, (channel_id, message_id, int(time.time())))
+
+def needs_own_request(post):
+    """Whether a backfilled post is sent on its own: replies, polls, forwards and posts with links to rewrite."""
+    if len(post) != 1:
+        return False
+    message = post[0]
+    return bool(
+        getattr(message.reply_to, 'reply_to_msg_id', None)
+        or message.poll
+        or message.fwd_from
+        or link_rewriter.rewrite_text(message.message) != message.message
+    )
+
+async def backfill_message(bot, channel_id, message, target_channel):
+    """Copy a single backfilled message the way a live post is mirrored by forward_media."""
+    if message.poll or message.fwd_from:
+        copied = await outbound.call(
+            PRIORITY_BACKFILL,
+            bot.forward_message,
+            chat_id=target_channel,
+            from_chat_id=channel_id,
+            message_id=message.id,
+        )
+    else:
+        reply_to_id = getattr(message.reply_to, 'reply_to_msg_id', None)
+        reply_to_message_id = None
+        if reply_to_id:
+            reply_to_message_id = await get_corresponding_message_id(channel_id, reply_to_id, target_channel)
+        # Telethon entities are not PTB ones, the text is rewritten as HTML instead
+        text = html.unparse(message.message, message.entities) if message.message else None
+        rewritten = link_rewriter.rewrite_text(text)
+        if rewritten != text and (message.media is None or isinstance(message.media, MessageMediaWebPage)):
+            copied = await outbound.call(
+                PRIORITY_BACKFILL,
+                bot.send_message,
+                chat_id=target_channel,
+                text=rewritten,
+                parse_mode=ParseMode.HTML,
+                reply_to_message_id=reply_to_message_id,
+            )
+        else:
+            copied = await outbound.call(
+                PRIORITY_BACKFILL,
+                bot.copy_message,
+                chat_id=target_channel,
+                from_chat_id=channel_id,
+                message_id=message.id,
+                caption=rewritten if rewritten != text else None,
+                parse_mode=ParseMode.HTML if rewritten != text else None,
+                reply_to_message_id=reply_to_message_id,
+            )
+    await store_mapping(channel_id, message.id, target_channel, copied.message_id)
+
+async def backfill_posts(bot, channel_id, posts):
+    """
+    Copy posts found by the backfill to the channels they have not reached yet. Every post is a
+    list of messages, the items of an album. A post that needs its own request is sent like a
+    live one, anything else is copied with one copy_messages request per channel. Album
+    captions are copied as they are.
+    """
+    message_ids = {}
+    for post in posts:
+        await wait_for_post(channel_id, post[0].id)
+        for target_channel in await get_unmirrored_channels(channel_id, post[0].id):
+            message_ids.setdefault(target_channel, []).extend(message.id for message in post)
+    single = posts[0][0] if len(posts) == 1 and needs_own_request(posts[0]) else None
+
+    async def copy_to(target_channel):
+        if single is not None:
+            await backfill_message(bot, channel_id, single, target_channel)
+        else:
+            await copy_messages_batch(bot, channel_id, message_ids[target_channel], target_channel, priority=PRIORITY_BACKFILL)
+
+    results = await fan_out(fanout_semaphore, list(message_ids), copy_to)
+    flood_limited = None
+    for target_channel, result in results.items():
+        if isinstance(result, RetryAfter):
+            flood_limited = result
+        elif isinstance(result, Exception):
+            logger.error("Failed to backfill messages %s-%s of channel %s to channel %s: %s",
+                         posts[0][0].id, posts[-1][-1].id, channel_id, target_channel, result)
+    if flood_limited is not None:
+        # The channels that were reached are mapped, the posts are retried for the others
+        raise flood_limited
+
+async def backfill_channel(bot, channel_id, start_id, end_id):
+    """Copy the posts of a channel between ``start_id``, the last one the bridge knew of, and ``end_id``, oldest first."""
+    if start_id is None:
+        # A channel new to the bridge, its older posts are not copied
+        await save_backfill_position(channel_id, end_id)
+        return 0
+    if start_id >= end_id:
+        return 0
+
+    copied = 0
+    batch = []
+
+    async def flush():
+        nonlocal copied, batch
+        if not batch:
+            return
+        posts, batch = batch, []
+        while True:
+            try:
+                await backfill_posts(bot, channel_id, posts)
+                break
+            except RetryAfter as e:
+                logger.warning("Backfill of channel %s is flood limited, waiting %ss", channel_id, retry_after_seconds(e))
+                await asyncio.sleep(retry_after_seconds(e))
+        await save_backfill_position(channel_id, posts[-1][-1].id)
+        copied += len(posts)
+
+    async def add(post):
+        # Some posts are sent on their own, the others are copied together up to BATCH_COPY_SIZE messages
+        own_request = needs_own_request(post)
+        if own_request or sum(len(queued) for queued in batch) + len(post) > BATCH_COPY_SIZE:
+            await flush()
+        batch.append(post)
+        if own_request:
+            await flush()
+
+    logger.info("Backfilling channel %s from message %s to %s", channel_id, start_id, end_id)
+    post = []
+    peer = PeerChannel(to_telethon_channel(channel_id))
+    async for message in telethon_client.iter_messages(peer, min_id=start_id, max_id=end_id + 1, reverse=True):
+        if message.action is not None:
+            continue
+        # Items of an album follow each other and share their grouped_id
+        if post and message.grouped_id is not None and message.grouped_id == post[-1].grouped_id:
+            post.append(message)
+            continue
+        if post:
+            await add(post)
+        post = [message]
+    if post:
+        await add(post)
+    await flush()
+    return copied
+
+async def run_backfill(bot, start_ids):
+    """Mirror the posts published while the bridge was offline, after the ``start_ids`` snapshot of get_backfill_starts."""
+    while not telethon_client.is_connected():
+        await asyncio.sleep(1)
+    await asyncio.sleep(BACKFILL_DELAY)
+
+    # Only posts older than the newest one at this point are backfilled, newer ones are
+    # live posts or copies made by the backfill itself
+    end_ids = {}
+    for channel_id in shard_groups.channels:
+        latest = await call_telethon(
+            'get_messages', telethon_client.get_messages(PeerChannel(to_telethon_channel(channel_id)), limit=1)
+        )
+        if latest:
+            end_ids[channel_id] = latest[0].id
+
+    results = await fan_out(
+        asyncio.Semaphore(BACKFILL_CONCURRENCY),
+        list(end_ids),
+        lambda channel_id: backfill_channel(bot, channel_id, start_ids.get(channel_id), end_ids[channel_id]),
+    )
+    for channel_id, result in results.items():
+        if isinstance(result, Exception):
+            logger.error("Backfill of channel %s failed: %s", channel_id, result)
+        elif result:
+            logger.info("Backfilled %s posts of channel %s", result, channel_id)
 
 def to_ptb_channel(channel_id):
     """Convert a numeric channel ID to a format usable by python-telegram-bot."""
@@ -142,55 +689,86 @@ def to_ptb_channel(channel_id):
         channel_id = "-100" + str(channel_id)
     return channel_id
 
-
-def replace_x_links(text: str) -> str:
-    """Replace x.com links with fxtwitter.com."""
-    if not text:
-        return text
-    return re.sub(r"(?i)\b((?:https?://)?)(?:www\.)?x\.com(?=/|\b)", r"\1fxtwitter.com", text)
+def to_telethon_channel(channel_id):
+    """Convert a python-telegram-bot channel ID to the bare ID used by Telethon."""
+    channel_id = str(channel_id)
+    return int(channel_id[4:]) if channel_id.startswith('-100') else int(channel_id)
 
 
 async def normalize_source_message_links(bot: Bot, message: Message):
-    """Edit source message in place if it contains x.com links."""
+    """Edit source message in place if it contains links to rewrite."""
     try:
         if message.text:
-            replaced_text = replace_x_links(message.text)
+            replaced_text, entities = link_rewriter.rewrite(message.text, message.entities)
             if replaced_text != message.text:
-                await bot.edit_message_text(
-                    chat_id=message.chat_id,
-                    message_id=message.message_id,
-                    text=replaced_text,
-                    entities=message.entities
-                )
+                edit_queue.submit(bot, message.chat_id, message.message_id, replaced_text, entities)
         elif message.caption:
-            replaced_caption = replace_x_links(message.caption)
+            replaced_caption, entities = link_rewriter.rewrite(message.caption, message.caption_entities)
             if replaced_caption != message.caption:
-                await bot.edit_message_caption(
-                    chat_id=message.chat_id,
-                    message_id=message.message_id,
-                    caption=replaced_caption,
-                    caption_entities=message.caption_entities
-                )
+                edit_queue.submit(bot, message.chat_id, message.message_id, replaced_caption, entities, is_caption=True)
     except Exception as e:
-        logger.warning(f"Failed to normalize source message {message.message_id}: {e}")
+        logger.warning("Failed to normalize source message %s: %s", message.message_id, e)
 
 # Reaction handling functions
-async def extract_message_reactions(message: Message):
-    """Extract reactions from a telethon message object into a dictionary."""
+def extract_reactions(reactions):
+    """Convert a telethon MessageReactions object into a dictionary."""
     reactions_dict = {}
-    if hasattr(message, 'reactions') and message.reactions:
-        if hasattr(message.reactions, 'results'):
-            for reaction in message.reactions.results:
-                if hasattr(reaction.reaction, 'emoticon'):
-                    reaction_type = str(reaction.reaction.emoticon)
-                elif hasattr(reaction.reaction, 'document_id'):
-                    reaction_type = ID_TO_CUSTOM_EMOJI_MAP.get(reaction.reaction.document_id, 'хз')
-                else:
-                    reaction_type = "✡"
-                reaction_count = reaction.count
-                reactions_dict[reaction_type] = reaction_count
+    if reactions and hasattr(reactions, 'results'):
+        for reaction in reactions.results:
+            if hasattr(reaction.reaction, 'emoticon'):
+                reaction_type = str(reaction.reaction.emoticon)
+            elif hasattr(reaction.reaction, 'document_id'):
+                reaction_type = ID_TO_CUSTOM_EMOJI_MAP.get(reaction.reaction.document_id, 'хз')
+            else:
+                reaction_type = "✡"
+            reaction_count = reaction.count
+            reactions_dict[reaction_type] = reaction_count
     return reactions_dict
 
+async def call_telethon(method, coroutine):
+    """Await a Telethon request, counting it by outcome."""
+    try:
+        result = await coroutine
+    except errors.FloodWaitError:
+        TELETHON_CALLS.inc(method=method, outcome='flood_wait')
+        raise
+    except Exception:
+        TELETHON_CALLS.inc(method=method, outcome='error')
+        raise
+    TELETHON_CALLS.inc(method=method, outcome='ok')
+    return result
+
+async def fetch_message_reactions(channel_id, message_ids):
+    """
+    Fetch only the reactions of the given messages, without downloading the messages.
+    Returns a dict of message ID -> reactions dict; messages without reactions are omitted.
+    """
+    reactions_by_id = {}
+    peer = PeerChannel(channel_id)
+    for start in range(0, len(message_ids), REACTION_FETCH_BATCH_SIZE):
+        batch = message_ids[start:start + REACTION_FETCH_BATCH_SIZE]
+        result = await call_telethon('GetMessagesReactions', telethon_client(GetMessagesReactionsRequest(peer=peer, id=batch)))
+        for update in getattr(result, 'updates', []):
+            if isinstance(update, UpdateMessageReactions):
+                reactions_by_id[update.msg_id] = extract_reactions(update.reactions)
+    return reactions_by_id
+
+def get_canonical_body(message: Message, footer=""):
+    """
+    Get the text or caption of a PTB message as it is mirrored, without the reactions footer.
+    The footer is only stripped when it matches the one last rendered under the message.
+    """
+    text = message.text or message.caption or ""
+    entities = message.entities if message.text else message.caption_entities
+    if footer and text.endswith(footer.rstrip()):
+        text = text[:-len(footer.rstrip())].rstrip("\n")
+    text, entities = link_rewriter.rewrite(text, entities)
+    return {
+        'text': text,
+        'entities': entities or (),
+        'is_media': not message.text,
+    }
+
 async def get_message_text(message):
     """Get message text/caption and determine if it's text or caption."""
     message_text = ""
@@ -204,7 +782,7 @@ async def get_message_text(message):
     if "---" in message_text:
         message_text = message_text.split("---")[0].strip()
 
-    return replace_x_links(message_text)
+    return link_rewriter.rewrite_text(message_text)
 
 async def build_reactions_summary(reactions_dict):
     """Build a formatted string of reactions for display."""
@@ -216,151 +794,133 @@ async def build_reactions_summary(reactions_dict):
         reactions_text += f"{emoji} {count} "
     return reactions_text
 
-async def combine_reactions(source_reactions, target_reactions):
-    """Combine reactions from source and target channels."""
-    combined_reactions = {}
-    all_emojis = set(list(source_reactions.keys()) + list(target_reactions.keys()))
-    
-    for emoji in all_emojis:
-        combined_reactions[emoji] = (source_reactions.get(emoji, 0) + target_reactions.get(emoji, 0))
-    
-    return combined_reactions
+def render_with_footer(text, reactions_summary):
+    """Append the reactions footer to a message body."""
+    if text and reactions_summary:
+        return f"{text}\n{reactions_summary}"
+    return text or reactions_summary
 
-async def update_message_with_reactions(bot: Bot, chat_id, message, reactions_summary):
-    """Update a message with the given text and reactions."""
-    message_text = await get_message_text(message)
-    try:
-        new_text = f"{message_text}\n{reactions_summary}" if reactions_summary else message_text
-        if message.media is None:
-            await bot.edit_message_text(
-                text=new_text,
-                chat_id=chat_id,
-                message_id=message.id,
-            )
-        else:
-            await bot.edit_message_caption(
-                caption=new_text,
-                chat_id=chat_id,
-                message_id=message.id
-            )
-        return True
-    except Exception as e:
-        logger.error(f"Error updating message {message.id} in chat {chat_id}: {e}")
-        return False
+async def fetch_message_body(channel_id, message_id):
+    """Build a message body from the live message, for messages mirrored before bodies were stored."""
+    messages = await call_telethon(
+        'get_messages',
+        telethon_client.get_messages(PeerChannel(to_telethon_channel(channel_id)), ids=[message_id])
+    )
+    message = messages[0] if messages else None
+    if not message:
+        return None
+    return {
+        'text': await get_message_text(message),
+        'entities': (),
+        'is_media': message.media is not None,
+        'footer': "",
+    }
 
-async def process_reaction_change(bot, channel_id, message, reactions_dict):
+async def update_message_with_reactions(bot: Bot, chat_id, message_id, body, reactions_summary):
+    """Queue an update of a message with its canonical body and the given reactions."""
+    new_text = render_with_footer(body['text'], reactions_summary)
+    # The footer is appended after the body, so the body's entity offsets stay valid
+    edit_queue.submit(bot, chat_id, message_id, new_text, body['entities'], is_caption=body['is_media'], priority=PRIORITY_REACTION)
+    await store_message_footer(chat_id, message_id, reactions_summary)
+
+@timed(STAGE_SECONDS, stage='process_reaction_change')
+async def process_reaction_change(bot, channel_id, message_id, reactions_dict):
     """Process a change in message reactions."""
-    message_id = message.id
     try:
-        logger.info(f"Processing reaction change for message {message_id} in channel {channel_id}")
+        logger.info("Processing reaction change for message %s in channel %s", message_id, channel_id)
         
-        pred_reaction = get_stored_reactions(channel_id, message_id)
-        for k, v in pred_reaction.items():
+        # Find the same post in the other channels of the shard group
+        source_channel_ptb = int(to_ptb_channel(channel_id))
+        mirrored = await get_mirrored_messages(source_channel_ptb, message_id)
+
+        # Counts never go down, keep the highest seen. Linking before storing lets the
+        # change update the combined counts of the copies by its difference.
+        key = (channel_id, message_id)
+        observed = dict(reactions_dict)
+        for k, v in reaction_state.get(key).items():
             reactions_dict[k] = max(reactions_dict.get(k, 0), v)
-        # Store the updated reactions
-        store_reactions(channel_id, message_id, reactions_dict)
+        if mirrored:
+            reaction_state.link([key] + [(to_telethon_channel(channel), copied_id) for channel, copied_id in mirrored])
+        reaction_state.set(key, reactions_dict, observed=observed)
         
-        # Find corresponding message in the other channel
-        target_channel = channel2_telethon if channel_id == channel1_telethon else channel1_telethon
-        target_channel_ptb = channel2 if channel_id == channel1_telethon else channel1
-        source_channel_ptb = channel1 if channel_id == channel1_telethon else channel2
-        
-        # Use the bidirectional lookup function to find the corresponding message
-        copied_message_id = get_corresponding_message_id(
-            to_ptb_channel(channel_id), 
-            message_id, 
-            to_ptb_channel(target_channel)
-        )
-        
-        if not copied_message_id:
-            logger.info(f"No corresponding message found for {message_id} in target channel")
+        if not mirrored:
+            logger.info("No corresponding message found for %s in other channels", message_id)
             return
             
-        logger.info(f"Corresponding message {copied_message_id} found in channel {target_channel}")
-        
-        # Get reactions for the copied message in the target channel
-        target_reactions_dict = get_stored_reactions(target_channel, copied_message_id) or {}
+        logger.debug("Corresponding messages %s found for %s", mirrored, message_id)
         
-        # Combine reactions from both channels
-        combined_reactions = await combine_reactions(reactions_dict, target_reactions_dict)
+        # Combined reactions of all channels, kept up to date by the reaction state
+        combined_reactions = reaction_state.combined(key)
         
         # Create the reactions summary text
         reactions_text = await build_reactions_summary(combined_reactions)
         
-        # Retrieve the source and target messages
-        source_message = await telethon_client.get_messages(PeerChannel(channel_id), ids=[message_id])
-        source_message = source_message[0] if source_message else None
-        
-        target_message = await telethon_client.get_messages(PeerChannel(target_channel), ids=[copied_message_id])
-        target_message = target_message[0] if target_message else None
-        
-        # Update both messages with the combined reactions
-        if source_message:
-            success = await update_message_with_reactions(
-                bot,
-                source_channel_ptb,
-                source_message,
-                reactions_text,
-            )
-            if success:
-                logger.info(f"Updated source message {message_id} with reactions")
-
-        if target_message:
-            success = await update_message_with_reactions(
-                bot,
-                target_channel_ptb,
-                target_message,
-                reactions_text
-            )
-            if success:
-                logger.info(f"Updated target message {copied_message_id} with reactions")
+        # Update every copy with the combined reactions. They are rendered from the stored bodies,
+        # only messages mirrored before bodies were stored are fetched.
+        for target_channel_ptb, target_message_id in [(source_channel_ptb, message_id)] + mirrored:
+            body = await get_message_body(target_channel_ptb, target_message_id) or await fetch_message_body(target_channel_ptb, target_message_id)
+            if body:
+                await update_message_with_reactions(
+                    bot,
+                    target_channel_ptb,
+                    target_message_id,
+                    body,
+                    reactions_text,
+                )
+                logger.debug("Queued reactions update of message %s in channel %s", target_message_id, target_channel_ptb)
                     
     except Exception as e:
         stack_trace = traceback.format_exc()
-        logger.error(f"Error processing reaction change: {e}\n{stack_trace}")
+        logger.error("Error processing reaction change: %s\n%s", e, stack_trace)
 
 # Message handling functions
 async def forward_media(bot: Bot, message: Message, target_channel: int, reply_to_message_id: int = None):
     """Forward or copy a message to the target channel."""
     try:
-        # Check if the message is part of a media group
-        if message.media_group_id:
-            # We'll handle media groups separately in the channel_post_handler
-            # Just return the message for now to maintain the function signature
-            logger.info(f"Message {message.message_id} is part of media group {message.media_group_id}, will handle separately")
-            return message
-        
-        # Regular forwarding for non-media group messages
         # Check if message is a forward or poll - these need to be forwarded, not copied
         is_forward = hasattr(message, 'forward_origin') and message.forward_origin
                      
         if (hasattr(message, 'poll') and message.poll) or is_forward:
-            logger.info(f"Forwarding message {message.message_id} instead of copying")
-            copied_message = await bot.forward_message(
+            logger.info("Forwarding message %s instead of copying", message.message_id)
+            copied_message = await outbound.call(
+                PRIORITY_POST,
+                bot.forward_message,
                 chat_id=target_channel,
                 from_chat_id=message.chat_id,
                 message_id=message.message_id
             )
         elif message.text:
-            copied_message = await bot.send_message(
+            text, entities = link_rewriter.rewrite(message.text, message.entities)
+            copied_message = await outbound.call(
+                PRIORITY_POST,
+                bot.send_message,
                 chat_id=target_channel,
-                text=replace_x_links(message.text),
-                entities=message.entities,
+                text=text,
+                entities=entities,
                 reply_to_message_id=reply_to_message_id
             )
         else:
-            copied_message = await bot.copy_message(
+            caption, caption_entities = link_rewriter.rewrite(message.caption, message.caption_entities)
+            copied_message = await outbound.call(
+                PRIORITY_POST,
+                bot.copy_message,
                 chat_id=target_channel,
                 from_chat_id=message.chat_id,
                 message_id=message.message_id,
-                caption=replace_x_links(message.caption) if message.caption else None,
-                caption_entities=message.caption_entities,
+                caption=caption or None,
+                caption_entities=caption_entities,
                 reply_to_message_id=reply_to_message_id
             )
+    except RetryAfter:
+        # Still flood limited after the scheduler's retries, forwarding would only add traffic
+        raise
     except Exception as e:
-        logger.error(f"Failed to forward message {message.message_id} to channel {target_channel}: {e}")
+        logger.error("Failed to forward message %s to channel %s: %s", message.message_id, target_channel, e)
         # Fallback to direct forwarding
-        copied_message = await bot.forward_message(
+        FALLBACKS.inc(path='forward_message')
+        copied_message = await outbound.call(
+            PRIORITY_POST,
+            bot.forward_message,
             chat_id=target_channel,
             from_chat_id=message.chat_id,
             message_id=message.message_id
@@ -368,317 +928,286 @@ async def forward_media(bot: Bot, message: Message, target_channel: int, reply_t
     
     return copied_message
 
-async def forward_single_media(bot: Bot, message: Message, target_channel: int, reply_to_message_id: int = None):
-    """Forward a single media message, used as fallback for media groups."""
+async def copy_messages_batch(bot: Bot, source_channel, message_ids, target_channel, forward=False, priority=PRIORITY_POST):
+    """
+    Copy messages to a channel with copy_messages, or forward them with forward_messages,
+    BATCH_COPY_SIZE per request, and store their mappings in one transaction. Albums stay
+    albums. Returns the stored mappings.
+    """
+    method = bot.forward_messages if forward else bot.copy_messages
+    mappings = []
     try:
-        logger.info(f"Forwarding single media message {message.message_id}")
-        return await bot.forward_message(
-            chat_id=target_channel,
-            from_chat_id=message.chat_id,
-            message_id=message.message_id
-        )
-    except Exception as e:
-        logger.error(f"Failed to forward single media message: {e}")
-        return None
+        for start in range(0, len(message_ids), BATCH_COPY_SIZE):
+            batch = message_ids[start:start + BATCH_COPY_SIZE]
+            sent = await outbound.call(priority, method, chat_id=target_channel, from_chat_id=source_channel, message_ids=batch)
+            # Messages that cannot be copied are skipped, then the results no longer line up with the sources
+            if len(sent) != len(batch):
+                logger.warning("%s of %s messages of channel %s reached channel %s, not mapping them",
+                               len(sent), len(batch), source_channel, target_channel)
+                continue
+            mappings.extend(
+                (source_channel, message_id, target_channel, sent_message.message_id)
+                for message_id, sent_message in zip(batch, sent)
+            )
+    finally:
+        # Batches sent before a failure are mapped all the same
+        await store_mappings(mappings)
+    return mappings
 
 # Handler for new channel posts
+@timed(STAGE_SECONDS, stage='channel_post_handler')
 async def channel_post_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     message = update.channel_post
     if not message:
         return
 
+    source_channel = message.chat_id
+    target_channels = shard_groups.peers(source_channel)
+    if not target_channels:
+        logger.info("Channel %s is not in any shard group, ignoring post", source_channel)
+        return
+
+    # Journal the post first, it is replayed after a restart until its copies are stored
+    await journal_posts([message])
+
     await normalize_source_message_links(context.bot, message)
 
-    logger.info(f"Copy message: {message.text if message.text else '(Media message)'}")
-    source_channel = message.chat_id
-    logger.info(f"chat_id={source_channel}")
-    logger.info(f"message_id={message.message_id}")
-    logger.info(f"reply_to_message_id={message.reply_to_message.message_id if message.reply_to_message else None}")
-    logger.info(f"media_group_id={message.media_group_id}")
-    
-    target_channel = channel2 if source_channel == channel1 else channel1
+    logger.info("Copy message: %s", message.text if message.text else '(Media message)')
+    logger.debug("chat_id=%s", source_channel)
+    logger.debug("message_id=%s", message.message_id)
+    logger.debug("reply_to_message_id=%s", message.reply_to_message.message_id if message.reply_to_message else None)
+    logger.debug("media_group_id=%s", message.media_group_id)
 
-    # Handle media groups - collect all messages and then process them as a group
+    # Handle media groups - collect all items and then send them to every target as one album
     if message.media_group_id:
-        # Set up the global media group tracking dictionary in application
-        if not hasattr(context.application, 'media_groups_data'):
-            context.application.media_groups_data = {}
-            
         media_group_id = message.media_group_id
-        logger.info(f"Message is part of media group {media_group_id}")
-        
-        # Check if we already have this media group in our tracking
-        if media_group_id not in context.application.media_groups_data:
-            # Initialize new media group entry
-            context.application.media_groups_data[media_group_id] = {
-                'messages': [],
-                'source_channel': source_channel,
-                'target_channel': target_channel,
-                'last_update': time.time(),
-                'processed': False,
-                'task': None,
-                'fallback_sent': False  # Track if we've sent individual messages as fallback
-            }
-            
-            # Create an async task to process this media group after a delay
-            async def delayed_process():
-                try:
-                    await asyncio.sleep(2.0)  # 2 seconds should be enough to collect all media
-                    
-                    # Check if we still have the media group data
-                    if hasattr(context.application, 'media_groups_data') and media_group_id in context.application.media_groups_data:
-                        # Process the media group
-                        await process_media_group(context, media_group_id)
-                    else:
-                        logger.warning(f"Media group {media_group_id} data was lost before processing")
-                except Exception as e:
-                    stack_trace = traceback.format_exc()
-                    logger.error(f"Error in delayed processing of media group {media_group_id}: {e}\n{stack_trace}")
-                    
-                    # If there was an error processing as a group, send individually as fallback
-                    await fallback_process_media_group(context, media_group_id)
-            
-            # Schedule task to process media group after delay
-            task = asyncio.create_task(delayed_process())
-            context.application.media_groups_data[media_group_id]['task'] = task
-            logger.info(f"Scheduled processing of media group {media_group_id} in 2 seconds")
-            
-            # Set up fallback timer to ensure messages get sent even if the task fails
-            async def fallback_timer():
-                try:
-                    await asyncio.sleep(5.0)  # Wait 5 seconds
-                    # If the media group hasn't been processed by now, process it individually
-                    if (hasattr(context.application, 'media_groups_data') and 
-                        media_group_id in context.application.media_groups_data and 
-                        not context.application.media_groups_data[media_group_id].get('processed', False)):
-                        logger.warning(f"Fallback timer triggered for media group {media_group_id}")
-                        await fallback_process_media_group(context, media_group_id)
-                except Exception as e:
-                    logger.error(f"Error in fallback timer: {e}")
-            
-            # Start the fallback timer
-            asyncio.create_task(fallback_timer())
-        
-        # Add message to the media group
-        context.application.media_groups_data[media_group_id]['messages'].append(message)
-        context.application.media_groups_data[media_group_id]['last_update'] = time.time()
-        logger.info(f"Added message to media group {media_group_id}, now has {len(context.application.media_groups_data[media_group_id]['messages'])} messages")
-        
-        # Don't process immediately - let the scheduled task do it after collecting all messages
-        return
-            
+        reply_to_message_id = message.reply_to_message.message_id if message.reply_to_message else None
+        added = media_groups.add(
+            media_group_id,
+            get_media_group_item(message),
+            bot=context.bot,
+            source_channel=source_channel,
+            target_channels=target_channels,
+            reply_to_message_id=reply_to_message_id,
+        )
+        if added:
+            logger.debug("Added message to media group %s", media_group_id)
+            return
+        # Too many albums are being collected, copy this item on its own rather than hold more
+        logger.warning("Media group collector is full, copying message %s of group %s individually", message.message_id, media_group_id)
+
     # Regular message handling (non-media group)
+    try:
+        await mirror_post(context.bot, message, target_channels)
+    finally:
+        release_posts([(source_channel, message.message_id)])
+
+async def mirror_post(bot: Bot, message: Message, target_channels):
+    """Copy a post to all target channels at once and store the mappings."""
+    source_channel = message.chat_id
     if message.reply_to_message:
-        # Get the original message ID of the replied message
-        copied_reply_id = message.reply_to_message.message_id
-        # Check if the original reply ID exists in the database for the source channel
-        original_reply_id = get_original_id(target_channel, copied_reply_id, source_channel)
-        copied_original_reply_id = get_copied_id(source_channel, copied_reply_id, target_channel)
-        
-        if original_reply_id is not None:
-            # Send the message as a reply to the copied message in the target channel
-            copied_message = await forward_media(context.bot, message, target_channel, reply_to_message_id=original_reply_id)
-        else:
-            # If the original reply ID doesn't exist in the database, try the other direction
-            copied_message = await forward_media(context.bot, message, target_channel, reply_to_message_id=copied_original_reply_id)
-    else:
-        # If the message is not a reply, send it as a new message
-        copied_message = await forward_media(context.bot, message, target_channel)
+        # Wait outside fan_out, a waiting reply must not hold the slots the replied post needs to be sent
+        await wait_for_post(source_channel, message.reply_to_message.message_id)
 
-    # Handle media group special case
-    if hasattr(copied_message, 'media_group_id') and copied_message.media_group_id:
-        # We've already handled this in the media group section
-        return
-        
-    logger.info(f"copied_message_id={copied_message.message_id}")
+    async def copy_to(target_channel):
+        reply_to_message_id = None
+        if message.reply_to_message:
+            # Find the replied message's counterpart in the target channel, whichever side is the original
+            reply_to_message_id = await get_corresponding_message_id(source_channel, message.reply_to_message.message_id, target_channel)
+        return await forward_media(bot, message, target_channel, reply_to_message_id=reply_to_message_id)
 
-    # Store the mapping of original message ID to copied message ID in the database
-    store_mapping(source_channel, message.message_id, target_channel, copied_message.message_id)
+    results = await fan_out(fanout_semaphore, target_channels, copy_to)
 
-# Helper function to process media groups
-async def process_media_group(context, media_group_id):
-    """Process a complete media group and send it to the target channel."""
-    if not hasattr(context.application, 'media_groups_data') or media_group_id not in context.application.media_groups_data:
-        logger.error(f"Media group {media_group_id} not found in tracking")
-        return
-    
-    group_data = context.application.media_groups_data[media_group_id]
-    
-    # Check if this group has already been processed
-    if group_data.get('processed', False):
-        logger.info(f"Media group {media_group_id} already processed, skipping")
-        return
-    
-    # Mark as processed to prevent double processing
-    context.application.media_groups_data[media_group_id]['processed'] = True
-    
-    messages = group_data['messages']
-    source_channel = group_data['source_channel']
-    target_channel = group_data['target_channel']
-    
-    if not messages:
-        logger.error(f"No messages found in media group {media_group_id}")
-        return
-    
-    logger.info(f"Processing media group {media_group_id} with {len(messages)} messages as a single group")
-    
+    mappings = []
+    for target_channel, copied_message in results.items():
+        if isinstance(copied_message, Exception):
+            logger.error("Failed to copy message %s to channel %s: %s", message.message_id, target_channel, copied_message)
+            continue
+        logger.debug("copied_message_id=%s in channel %s", copied_message.message_id, target_channel)
+        mappings.append((source_channel, message.message_id, target_channel, copied_message.message_id))
+
+    # Store the mappings of original message ID to copied message IDs in the database
+    await store_mappings(mappings)
+
+    # All copies carry the same body, so reaction footers can be rendered without fetching them
+    body = get_canonical_body(message)
+    await store_message_bodies(
+        [(source_channel, message.message_id, body)] + [(mapping[2], mapping[3], body) for mapping in mappings]
+    )
+    await complete_mirrored_posts([(source_channel, message.message_id)])
+
+def get_media_group_item(message: Message):
+    """Compact record of a media group item, enough to send it again as part of an album, with its links rewritten."""
+    if message.photo:
+        kind, file_id = 'photo', message.photo[-1].file_id
+    elif message.video:
+        kind, file_id = 'video', message.video.file_id
+    elif message.audio:
+        kind, file_id = 'audio', message.audio.file_id
+    elif message.document:
+        kind, file_id = 'document', message.document.file_id
+    else:
+        kind, file_id = None, None
+    caption, entities = link_rewriter.rewrite(message.caption, message.caption_entities)
+    return {
+        'message_id': message.message_id,
+        'kind': kind,
+        'file_id': file_id,
+        'caption': caption,
+        'entities': entities,
+    }
+
+# Called by the media group collector once a group is complete
+async def flush_media_group(group):
+    """Send a collected media group, copying its items to the channels where sending failed."""
+    posts = [(group['source_channel'], item['message_id']) for item in group['items']]
     try:
-        # Sort messages by message_id to ensure correct order
-        messages.sort(key=lambda msg: msg.message_id)
-        
-        # Prepare media for sending
-        media = []
-        reply_to_message_id = None
-        
-        # Check if any message is a reply
-        first_message = messages[0]
-        if first_message.reply_to_message:
-            copied_reply_id = first_message.reply_to_message.message_id
-            original_reply_id = get_original_id(target_channel, copied_reply_id, source_channel)
-            copied_original_reply_id = get_copied_id(source_channel, copied_reply_id, target_channel)
-            
-            if original_reply_id is not None:
-                reply_to_message_id = original_reply_id
-            else:
-                reply_to_message_id = copied_original_reply_id
-        
-        # Create InputMedia objects
-        from telegram import InputMediaPhoto, InputMediaVideo, InputMediaAudio, InputMediaDocument
-        
-        for msg in messages:
-            if msg.photo:
-                media.append(InputMediaPhoto(
-                    media=msg.photo[-1].file_id,
-                    caption=replace_x_links(msg.caption),
-                    parse_mode=ParseMode.HTML if hasattr(msg, 'caption_html') and msg.caption_html else None
-                ))
-            elif msg.video:
-                media.append(InputMediaVideo(
-                    media=msg.video.file_id,
-                    caption=replace_x_links(msg.caption),
-                    parse_mode=ParseMode.HTML if hasattr(msg, 'caption_html') and msg.caption_html else None
-                ))
-            elif msg.audio:
-                media.append(InputMediaAudio(
-                    media=msg.audio.file_id,
-                    caption=replace_x_links(msg.caption),
-                    parse_mode=ParseMode.HTML if hasattr(msg, 'caption_html') and msg.caption_html else None
-                ))
-            elif msg.document:
-                media.append(InputMediaDocument(
-                    media=msg.document.file_id,
-                    caption=replace_x_links(msg.caption),
-                    parse_mode=ParseMode.HTML if hasattr(msg, 'caption_html') and msg.caption_html else None
-                ))
-        
-        if not media:
-            logger.error(f"No valid media found in media group {media_group_id}")
-            return
-        
-        # Send the media group
-        logger.info(f"Sending media group with {len(media)} items")
-        sent_messages = await context.bot.send_media_group(
-            chat_id=target_channel,
-            media=media,
-            reply_to_message_id=reply_to_message_id
-        )
-        
-        # Store mappings
-        for i, sent_msg in enumerate(sent_messages):
-            if i < len(messages):
-                original_msg = messages[i]
-                store_mapping(source_channel, original_msg.message_id, target_channel, sent_msg.message_id)
-                logger.info(f"Stored mapping: {source_channel}:{original_msg.message_id} -> {target_channel}:{sent_msg.message_id}")
-        
-        # Clean up
-        del context.application.media_groups_data[media_group_id]
-        logger.info(f"Media group {media_group_id} processed successfully as a single group")
-        
+        failed_channels = await process_media_group(group)
+        if failed_channels:
+            FALLBACKS.inc(path='media_group')
+            await fallback_process_media_group(dict(group, target_channels=failed_channels))
     except Exception as e:
         stack_trace = traceback.format_exc()
-        logger.error(f"Error processing media group {media_group_id}: {e}\n{stack_trace}")
-        
-        # Fallback to individual forwarding
-        logger.info(f"Falling back to individual forwarding for media group {media_group_id}")
-        for msg in messages:
-            try:
-                copied_msg = await context.bot.forward_message(
-                    chat_id=target_channel,
-                    from_chat_id=msg.chat_id,
-                    message_id=msg.message_id
-                )
-                store_mapping(source_channel, msg.message_id, target_channel, copied_msg.message_id)
-                logger.info(f"Forwarded individual media: {msg.message_id} -> {copied_msg.message_id}")
-            except Exception as forward_error:
-                logger.error(f"Error forwarding individual media: {forward_error}")
-        
-        # Clean up
-        del context.application.media_groups_data[media_group_id]
-
-# Fallback function to process media groups individually
-async def fallback_process_media_group(context, media_group_id):
-    """Process a media group by forwarding messages individually."""
-    if not hasattr(context.application, 'media_groups_data') or media_group_id not in context.application.media_groups_data:
-        logger.error(f"Media group {media_group_id} not found in tracking for fallback processing")
-        return
+        logger.error("Error processing media group %s: %s\n%s", group['group_id'], e, stack_trace)
+        FALLBACKS.inc(path='media_group')
+        await fallback_process_media_group(group)
+    finally:
+        release_posts(posts)
+    await complete_mirrored_posts(posts)
+
+# Helper function to process media groups
+@timed(STAGE_SECONDS, stage='process_media_group')
+async def process_media_group(group):
+    """Process a complete media group and send it to every target channel.
+
+    Returns the channels it could not be sent to for a reason other than flood control.
+    """
+    media_group_id = group['group_id']
+    source_channel = group['source_channel']
+    # Sort items by message_id to ensure correct order
+    items = sorted(group['items'], key=lambda item: item['message_id'])
     
-    group_data = context.application.media_groups_data[media_group_id]
+    logger.info("Processing media group %s with %s messages as a single group", media_group_id, len(items))
+    if group['reply_to_message_id']:
+        # Wait outside fan_out, a waiting album must not hold the slots the replied post needs to be sent
+        await wait_for_post(source_channel, group['reply_to_message_id'])
     
-    # If already processed or fallback already sent, don't do it again
-    if group_data.get('processed', False) or group_data.get('fallback_sent', False):
-        return
+    results = await fan_out(
+        fanout_semaphore,
+        group['target_channels'],
+        lambda target_channel: send_media_group_copy(
+            group['bot'], media_group_id, items, source_channel, target_channel, group['reply_to_message_id']
+        )
+    )
+    failed_channels = []
+    for target_channel, result in results.items():
+        if isinstance(result, RetryAfter):
+            # Still flood limited after the scheduler's retries, copying would only add traffic
+            logger.error("Media group %s not sent to channel %s: %s", media_group_id, target_channel, result)
+        elif isinstance(result, Exception):
+            logger.error("Error processing media group %s for channel %s: %s", media_group_id, target_channel, result)
+            failed_channels.append(target_channel)
+    return failed_channels
+
+async def send_media_group_copy(bot: Bot, media_group_id, items, source_channel, target_channel, reply_to_message_id=None):
+    """Send a sorted media group to one target channel."""
+    # Find the replied message's counterpart in the target channel, the caller waited for it to be mirrored
+    if reply_to_message_id:
+        reply_to_message_id = await get_corresponding_message_id(source_channel, reply_to_message_id, target_channel)
     
-    # Mark as fallback sent
-    context.application.media_groups_data[media_group_id]['fallback_sent'] = True
+    # Create InputMedia objects
+    from telegram import InputMediaPhoto, InputMediaVideo, InputMediaAudio, InputMediaDocument
+    input_media_types = {
+        'photo': InputMediaPhoto,
+        'video': InputMediaVideo,
+        'audio': InputMediaAudio,
+        'document': InputMediaDocument,
+    }
     
-    messages = group_data['messages']
-    source_channel = group_data['source_channel']
-    target_channel = group_data['target_channel']
+    media = []
+    sent_items = []
+    for item in items:
+        input_media_type = input_media_types.get(item['kind'])
+        if input_media_type:
+            media.append(input_media_type(
+                media=item['file_id'],
+                caption=item['caption'],
+                caption_entities=item['entities']
+            ))
+            sent_items.append(item)
     
-    if not messages:
-        logger.error(f"No messages found in media group {media_group_id} for fallback processing")
+    if not media:
+        logger.error("No valid media found in media group %s", media_group_id)
         return
     
-    logger.info(f"FALLBACK: Processing media group {media_group_id} with {len(messages)} messages individually")
+    # Send the media group
+    logger.debug("Sending media group with %s items", len(media))
+    sent_messages = await outbound.call(
+        PRIORITY_POST,
+        bot.send_media_group,
+        chat_id=target_channel,
+        media=media,
+        reply_to_message_id=reply_to_message_id
+    )
+
+    # Store mappings in a single transaction. The album has been sent, a storage error must not send it again.
+    mappings = [
+        (source_channel, item['message_id'], target_channel, sent_msg.message_id)
+        for item, sent_msg in zip(sent_items, sent_messages)
+    ]
+    await store_mappings(mappings)
+    bodies = []
+    for item, sent_msg in zip(sent_items, sent_messages):
+        body = {
+            'text': item['caption'] or "",
+            'entities': item['entities'] or (),
+            'is_media': True,
+        }
+        bodies.append((source_channel, item['message_id'], body))
+        bodies.append((target_channel, sent_msg.message_id, body))
+    await store_message_bodies(bodies)
+    for mapping in mappings:
+        logger.debug("Stored mapping: %s:%s -> %s:%s", mapping[0], mapping[1], mapping[2], mapping[3])
+    
+    logger.info("Media group %s sent successfully as a single group to channel %s", media_group_id, target_channel)
+
+# Fallback function to process media groups without sending them again
+async def fallback_process_media_group(group):
+    """Process a media group by copying its messages instead of sending their media."""
+    media_group_id = group['group_id']
+    source_channel = group['source_channel']
+    items = sorted(group['items'], key=lambda item: item['message_id'])
     
+    logger.info("FALLBACK: Processing media group %s with %s messages as copies", media_group_id, len(items))
+    
+    await fan_out(
+        fanout_semaphore,
+        group['target_channels'],
+        lambda target_channel: copy_media_group_items(group['bot'], media_group_id, items, source_channel, target_channel)
+    )
+
+async def copy_media_group_items(bot: Bot, media_group_id, items, source_channel, target_channel):
+    """Copy the items of a sorted media group to one target channel in a single request."""
+    message_ids = [item['message_id'] for item in items]
     try:
-        # Sort messages by message_id to ensure correct order
-        messages.sort(key=lambda msg: msg.message_id)
-        
-        # Forward each message individually
-        for msg in messages:
-            try:
-                copied_msg = await forward_single_media(context.bot, msg, target_channel)
-                if copied_msg:
-                    store_mapping(source_channel, msg.message_id, target_channel, copied_msg.message_id)
-                    logger.info(f"FALLBACK: Forwarded media message: {msg.message_id} -> {copied_msg.message_id}")
-            except Exception as e:
-                logger.error(f"FALLBACK: Error forwarding individual media: {e}")
-        
-        # Clean up
-        del context.application.media_groups_data[media_group_id]
-        logger.info(f"FALLBACK: Media group {media_group_id} processed individually")
+        FALLBACKS.inc(path='copy_messages')
+        mappings = await copy_messages_batch(bot, source_channel, message_ids, target_channel)
+        logger.info("FALLBACK: Media group %s copied as %s messages to channel %s", media_group_id, len(mappings), target_channel)
         
+    except RetryAfter as e:
+        # Still flood limited after the scheduler's retries, forwarding would only add traffic
+        logger.error("FALLBACK: Media group %s not copied to channel %s: %s", media_group_id, target_channel, e)
     except Exception as e:
         stack_trace = traceback.format_exc()
-        logger.error(f"FALLBACK: Error in fallback processing for media group {media_group_id}: {e}\n{stack_trace}")
+        logger.error("FALLBACK: Error in fallback processing for media group %s: %s\n%s", media_group_id, e, stack_trace)
         
-        # Try one last approach - just direct forward each message
+        # Try one last approach - forward the messages instead of copying them
+        FALLBACKS.inc(path='emergency')
         try:
-            for msg in messages:
-                copied_msg = await context.bot.forward_message(
-                    chat_id=target_channel,
-                    from_chat_id=msg.chat_id,
-                    message_id=msg.message_id
-                )
-                store_mapping(source_channel, msg.message_id, target_channel, copied_msg.message_id)
-                logger.info(f"FALLBACK EMERGENCY: Forwarded media message: {msg.message_id} -> {copied_msg.message_id}")
+            mappings = await copy_messages_batch(bot, source_channel, message_ids, target_channel, forward=True)
+            logger.info("FALLBACK EMERGENCY: Forwarded %s media messages of group %s", len(mappings), media_group_id)
         except Exception as final_e:
-            logger.error(f"FALLBACK EMERGENCY: Final error: {final_e}")
-        
-        # Clean up
-        if hasattr(context.application, 'media_groups_data') and media_group_id in context.application.media_groups_data:
-            del context.application.media_groups_data[media_group_id]
+            logger.error("FALLBACK EMERGENCY: Final error: %s", final_e)
 
 # Handler for edited channel posts
 async def edited_channel_post_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -686,36 +1215,100 @@ async def edited_channel_post_handler(update: Update, context: ContextTypes.DEFA
     if not message:
         return
 
+    source_channel = message.chat_id
+    if source_channel not in shard_groups:
+        return
+
     await normalize_source_message_links(context.bot, message)
 
-    logger.info(f"Edited message: {message.text}")
-    source_channel = message.chat_id
-    target_channel = channel2 if source_channel == channel1 else channel1
+    logger.info("Edited message: %s", message.text)
 
-    # Get the copied message ID from the database
-    copied_message_id = get_copied_id(source_channel, message.message_id, target_channel)
-    logger.info(f"copied_message_id={copied_message_id}")
+    # Get the copied message IDs from the database, once the post itself has been mirrored
+    await wait_for_post(source_channel, message.message_id)
+    mirrored = await get_mirrored_messages(source_channel, message.message_id)
+    logger.debug("copied messages=%s", mirrored)
     
-    if copied_message_id:
+    if mirrored:
+        # Keep the stored bodies in sync, dropping the reactions footer if it was edited along
+        stored_body = await get_message_body(source_channel, message.message_id)
+        footer = stored_body['footer'] if stored_body else ""
+        body = get_canonical_body(message, footer)
+        await store_message_bodies(
+            [(source_channel, message.message_id, body)] + [(channel_id, message_id, body) for channel_id, message_id in mirrored]
+        )
+        if message.text or message.caption:
+            new_text = render_with_footer(body['text'], footer)
+            for target_channel, copied_message_id in mirrored:
+                edit_queue.submit(context.bot, target_channel, copied_message_id, new_text, body['entities'], is_caption=body['is_media'])
+
+async def sync_message_reactions(bot, channel_id, message_id, reactions_dict):
+    """Mirror a message's current reactions if they differ from the stored ones. Returns True on change."""
+    if not reaction_state.changed((channel_id, message_id), reactions_dict):
+        return False
+    logger.info("Reactions changed for message %s in channel %s", message_id, channel_id)
+    logger.debug("New reactions: %s", reactions_dict)
+    await process_reaction_change(bot, channel_id, message_id, reactions_dict)
+    return True
+
+def register_reaction_updates(bot):
+    """Subscribe to reaction updates pushed to the Telethon client."""
+    async def on_reaction_update(update):
+        if isinstance(update, UpdateMessageReactions):
+            peer, message_id, reactions = update.peer, update.msg_id, update.reactions
+        else:
+            # Channel message edits also carry the message's current reactions
+            message = update.message
+            peer, message_id, reactions = getattr(message, 'peer_id', None), message.id, getattr(message, 'reactions', None)
+            if reactions is None:
+                return
+
+        if not isinstance(peer, PeerChannel) or peer.channel_id not in telethon_channels:
+            return
+
+        reactions_dict = extract_reactions(reactions)
+        if not reactions_dict:
+            return
         try:
-            if message.text:
-                await context.bot.edit_message_text(
-                    text=replace_x_links(message.text),
-                    chat_id=target_channel,
-                    message_id=copied_message_id
-                )
-            elif message.caption:
-                await context.bot.edit_message_caption(
-                    caption=replace_x_links(message.caption),
-                    chat_id=target_channel,
-                    message_id=copied_message_id
-                )
+            if await sync_message_reactions(bot, peer.channel_id, message_id, reactions_dict):
+                reaction_scheduler.touch(peer.channel_id, message_id)
         except Exception as e:
-            logger.error(f"Error editing message: {e}")
+            stack_trace = traceback.format_exc()
+            logger.error("Error handling reaction update for message %s: %s\n%s", message_id, e, stack_trace)
+
+    telethon_client.add_event_handler(
+        on_reaction_update,
+        events.Raw(types=[UpdateMessageReactions, UpdateEditChannelMessage])
+    )
+    logger.info("Subscribed to reaction updates")
+
+async def poll_channel_reactions(bot, channel_id, message_ids):
+    """Poll the reactions of a batch of messages and mirror the ones that changed."""
+    changed_ids = set()
+    try:
+        reactions_by_id = await fetch_message_reactions(channel_id, message_ids)
+        for message_id, reactions_dict in reactions_by_id.items():
+            if reactions_dict and await sync_message_reactions(bot, channel_id, message_id, reactions_dict):
+                changed_ids.add(message_id)
+    except Exception as e:
+        stack_trace = traceback.format_exc()
+        logger.error("Error polling reactions in channel %s: %s\n%s", channel_id, e, stack_trace)
+    finally:
+        for message_id in message_ids:
+            reaction_scheduler.reschedule(channel_id, message_id, changed=message_id in changed_ids)
+
+@timed(STAGE_SECONDS, stage='check_reactions')
+async def run_reaction_poll_cycle(bot, now=None):
+    """Poll the messages that are due, at most REACTION_POLL_BUDGET requests, the most overdue first."""
+    for channel_id, message_ids in reaction_scheduler.pop_due(now).items():
+        await poll_channel_reactions(bot, channel_id, message_ids)
 
 # Function to periodically check for reactions
 async def check_reactions(app: Application):
-    """Periodically check for reactions on messages in monitored channels."""
+    """Poll reactions of mapped messages as they come due in the reaction scheduler.
+
+    When reaction updates are pushed by Telethon this mostly reconciles updates that
+    were missed, e.g. while the client was disconnected.
+    """
     bot = app.bot
     
     # Wait for telethon client to be ready
@@ -726,27 +1319,53 @@ async def check_reactions(app: Application):
     logger.info("Telethon client is connected, starting reaction checker")
     
     while True:
-        try:
-            for channel_id in [channel1_telethon, channel2_telethon]:
-                # Get recent messages from the channel
-                async for message in telethon_client.iter_messages(PeerChannel(channel_id), limit=MESSAGE_CHECK_FOR_REACTIONS_LIMIT):
-                    if message.reactions:
-                        # Extract reactions from the message
-                        reactions_dict = await extract_message_reactions(message)
-                        
-                        # Check if reactions have changed
-                        if reactions_changed(channel_id, message.id, reactions_dict):
-                            logger.info(f"Reactions changed for message {message.id} in channel {channel_id}")
-                            logger.info(f"New reactions: {reactions_dict}")
-                            
-                            # Process the reaction change
-                            await process_reaction_change(bot, channel_id, message, reactions_dict)
-        except Exception as e:
-            stack_trace = traceback.format_exc()
-            logger.error(f"Error in check_reactions: {e}\n{stack_trace}")
+        await run_reaction_poll_cycle(bot)
         
         # Wait before checking again
-        await asyncio.sleep(30)  # Check every 30 seconds
+        await asyncio.sleep(REACTION_POLL_TICK)
+
+async def get_prunable_reactions(cutoff):
+    """
+    Messages whose reactions can be pruned: stale, like every copy of their post. Copies share
+    their combined counts, pruning one while another is still live would lower the counts shown.
+    """
+    stale = set(await find_stale_reactions(storage, cutoff))
+
+    def idle(key):
+        # Counts changed since the last flush are newer than their stored update time
+        return not reaction_state.is_dirty(key) and (key in stale or key not in reaction_state)
+
+    prunable = []
+    for channel_id, message_id in stale:
+        if not idle((channel_id, message_id)):
+            continue
+        copies = await get_mirrored_messages(int(to_ptb_channel(channel_id)), message_id)
+        if all(idle((to_telethon_channel(copy_channel), copy_id)) for copy_channel, copy_id in copies):
+            prunable.append((channel_id, message_id))
+    return prunable
+
+async def apply_retention():
+    """Archive old mappings, delete old reactions and compact the database."""
+    now = int(time.time())
+    archived = 0
+    if RETENTION_MAPPING_DAYS:
+        archived = await archive_mappings(storage, now - RETENTION_MAPPING_DAYS * 86400, RETENTION_CHUNK_ROWS)
+    pruned = []
+    if RETENTION_REACTION_DAYS:
+        pruned = await get_prunable_reactions(now - RETENTION_REACTION_DAYS * 86400)
+        await prune_reactions(storage, pruned, RETENTION_CHUNK_ROWS)
+        reaction_state.forget(pruned)
+    freed_pages = await incremental_vacuum(storage, VACUUM_CHUNK_PAGES)
+    logger.info("Retention archived %s mappings, pruned reactions of %s messages and freed %s pages",
+                archived, len(pruned), freed_pages)
+
+async def run_retention():
+    while True:
+        await asyncio.sleep(RETENTION_INTERVAL)
+        try:
+            await apply_retention()
+        except Exception as e:
+            logger.error("Retention run failed: %s\n%s", e, traceback.format_exc())
 
 async def run_telethon():
     """Run the Telethon client."""
@@ -757,7 +1376,14 @@ async def run_telethon():
 async def main():
     """Set up and run the bot."""
     # Create the Application
-    application = Application.builder().token(API_TOKEN).build()
+    application = (
+        Application.builder()
+        .token(API_TOKEN)
+        .base_url(BOT_API_BASE_URL)
+        .update_queue(asyncio.Queue(maxsize=UPDATE_QUEUE_SIZE))
+        .concurrent_updates(KeyedUpdateProcessor(UPDATE_CONCURRENCY, max_concurrent_updates=UPDATE_QUEUE_SIZE))
+        .build()
+    )
     
     # Add handlers for channel posts
     application.add_handler(MessageHandler(filters.ChatType.CHANNEL & filters.UpdateType.CHANNEL_POST, channel_post_handler))
@@ -765,16 +1391,79 @@ async def main():
     # Add handler for edited channel posts
     application.add_handler(MessageHandler(filters.ChatType.CHANNEL & filters.UpdateType.EDITED_CHANNEL_POST, edited_channel_post_handler))
     
+    Gauge("bridge_update_queue_size", "Updates received but not yet handled.", application.update_queue.qsize)
+
+    loop_watchdog = None
+    if LOOP_WATCHDOG_THRESHOLD:
+        loop_watchdog = LoopWatchdog(interval=LOOP_WATCHDOG_INTERVAL, threshold=LOOP_WATCHDOG_THRESHOLD)
+        loop_watchdog.start()
+
+    profiler = Profiler(seconds=PROFILE_SECONDS, directory=PROFILE_DIR)
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGUSR1, profiler.start)
+    except (NotImplementedError, AttributeError):
+        logger.info("Signals are not supported here, profiling is only available with PROFILE_ON_START")
+    if PROFILE_ON_START:
+        profiler.start()
+
+    metrics_server = None
+    if METRICS_PORT:
+        metrics_server = MetricsServer(METRICS_LISTEN, METRICS_PORT)
+        await metrics_server.start()
+
+    # Preload recent mappings before any update is handled
+    await warm_mapping_cache()
+    await load_reaction_schedule()
+    await load_reaction_state()
+    reaction_flush_task = asyncio.create_task(flush_reactions_periodically())
+    retention_task = asyncio.create_task(run_retention()) if RETENTION_INTERVAL else None
+
+    # Where the backfill starts, before live posts and replays move the channels forward
+    backfill_starts = await get_backfill_starts() if TELETHON_ENABLED and BACKFILL_ENABLED else None
+
     # Start the bot
     await application.initialize()
     await application.start()
-    await application.updater.start_polling()
-    
-    # Start the telethon client
-    telethon_task = asyncio.create_task(run_telethon())
+
+    # Finish mirroring posts interrupted by the last shutdown before taking new ones
+    await replay_outbox(application.bot)
+
+    webhook_server = None
+    if BOT_MODE == "webhook":
+        webhook_server = WebhookServer(
+            application,
+            WEBHOOK_URL,
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            path=WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET,
+        )
+        try:
+            await webhook_server.start()
+        except Exception as e:
+            logger.error("Failed to start webhook mode, falling back to polling: %s", e)
+            webhook_server = None
+    if webhook_server is None:
+        # Polling removes any webhook that is still set
+        await application.updater.start_polling()
     
-    # Start the reaction checker as a background task
-    reactions_task = asyncio.create_task(check_reactions(application))
+    telethon_task = None
+    reactions_task = None
+    backfill_task = None
+    if TELETHON_ENABLED:
+        # Mirror reactions as soon as Telegram pushes them
+        if REACTION_UPDATES_ENABLED:
+            register_reaction_updates(application.bot)
+
+        # Start the telethon client
+        telethon_task = asyncio.create_task(run_telethon())
+
+        # Catch up on posts published while the bridge was offline
+        if BACKFILL_ENABLED:
+            backfill_task = asyncio.create_task(run_backfill(application.bot, backfill_starts))
+        
+        # Start the reaction checker as a background task
+        reactions_task = asyncio.create_task(check_reactions(application))
     
     logger.info("Bot started")
     
@@ -789,19 +1478,38 @@ async def main():
         logger.info("Application task was cancelled")
     finally:
         # Cancel background tasks
-        telethon_task.cancel()
-        reactions_task.cancel()
+        if telethon_task is not None:
+            telethon_task.cancel()
+        if reactions_task is not None:
+            reactions_task.cancel()
+        if backfill_task is not None:
+            backfill_task.cancel()
+        reaction_flush_task.cancel()
+        if retention_task is not None:
+            retention_task.cancel()
         
         # Stop and shutdown the app
         logger.info("Stopping updater...")
-        await application.updater.stop()
+        if webhook_server is not None:
+            await webhook_server.stop()
+        if metrics_server is not None:
+            await metrics_server.stop()
+        if loop_watchdog is not None:
+            loop_watchdog.stop()
+        if application.updater.running:
+            await application.updater.stop()
         
         logger.info("Shutting down application...")
         await application.stop()
         await application.shutdown()
         
-        # Close database
-        conn.close()
+        logger.info("Mapping cache stats: %s", mapping_cache.stats())
+
+        # Write the reaction counts changed since the last flush
+        await flush_reactions()
+
+        # Flush pending writes and close database
+        storage.close()
         
         logger.info("Application shut down successfully")
 
@@ -813,5 +1521,4 @@ if __name__ == '__main__':
         logger.info("Script stopped by user.")
     finally:
         # Close the database connection when the script ends
-        if 'conn' in locals():
-            conn.close() 
\ No newline at end of file
+        storage.close()
@@ -0,0 +1,57 @@
+from collections import OrderedDict
+
+
+class MappingCache:
+    """Bounded, bidirectional LRU cache of message mappings.
+
+    Each entry is keyed by ``(channel, message_id)`` and holds the IDs of the same post in
+    the other channels, so a mapping can be resolved from either side. The least recently
+    used entries are evicted once ``capacity`` is exceeded.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, channel, message_id, peer_channel, peer_message_id):
+        """Link two messages to each other."""
+        self._link((int(channel), int(message_id)), int(peer_channel), int(peer_message_id))
+        self._link((int(peer_channel), int(peer_message_id)), int(channel), int(message_id))
+
+    def get(self, channel, message_id, target_channel):
+        """Return the ID of the message's counterpart in ``target_channel``, or None."""
+        key = (int(channel), int(message_id))
+        peers = self._entries.get(key)
+        if peers is not None:
+            peer_id = peers.get(int(target_channel))
+            if peer_id is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return peer_id
+        self.misses += 1
+        return None
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'capacity': self.capacity,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+    def _link(self, key, peer_channel, peer_message_id):
+        peers = self._entries.get(key)
+        if peers is None:
+            peers = self._entries[key] = {}
+        else:
+            self._entries.move_to_end(key)
+        peers[peer_channel] = peer_message_id
+        while len(self._entries) > self.capacity:
+            self._entries.popitem(last=False)
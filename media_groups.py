@@ -0,0 +1,90 @@
+import asyncio
+import heapq
+
+from log import get_logger
+
+logger = get_logger("media_groups")
+
+
+class MediaGroupCollector:
+    """Collects the items of media groups (albums) and flushes every group once complete.
+
+    Telegram delivers the items of an album as separate updates sharing a media group ID.
+    A group is flushed to ``on_flush`` once no item arrived for ``quiet_gap`` seconds,
+    ``max_wait`` seconds after its first item at the latest, or right away when it holds
+    ``max_items`` items. All groups share one deadline heap served by a single timer task.
+    At most ``max_groups`` groups are collected at once, ``add`` refuses items beyond that.
+    """
+
+    def __init__(self, on_flush, quiet_gap=0.5, max_wait=3.0, max_groups=100, max_items=10):
+        self.on_flush = on_flush
+        self.quiet_gap = quiet_gap
+        self.max_wait = max_wait
+        self.max_groups = max_groups
+        self.max_items = max_items
+        self._groups = {}
+        self._deadlines = []
+        self._wakeup = None
+        self._worker = None
+
+    def __len__(self):
+        return len(self._groups)
+
+    def add(self, group_id, item, **info):
+        """
+        Add an item to its group, creating the group with ``info`` if it is new.
+        Returns False if the item was refused because too many groups are being collected.
+        """
+        loop = asyncio.get_running_loop()
+        if self._worker is None or self._worker.done():
+            self._wakeup = asyncio.Event()
+            self._worker = loop.create_task(self._run())
+
+        now = loop.time()
+        group = self._groups.get(group_id)
+        if group is None:
+            if len(self._groups) >= self.max_groups:
+                return False
+            group = self._groups[group_id] = dict(info, group_id=group_id, items=[], started=now)
+        group['items'].append(item)
+
+        if len(group['items']) >= self.max_items:
+            group['deadline'] = now
+        else:
+            group['deadline'] = min(now + self.quiet_gap, group['started'] + self.max_wait)
+        heapq.heappush(self._deadlines, (group['deadline'], group_id))
+        self._wakeup.set()
+        return True
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            self._wakeup.clear()
+            if not self._deadlines:
+                await self._wakeup.wait()
+                continue
+
+            deadline, group_id = self._deadlines[0]
+            group = self._groups.get(group_id)
+            if group is None or group['deadline'] != deadline:
+                # Stale entry, the group was flushed or got a later deadline
+                heapq.heappop(self._deadlines)
+                continue
+
+            delay = deadline - loop.time()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            heapq.heappop(self._deadlines)
+            del self._groups[group_id]
+            loop.create_task(self._flush(group))
+
+    async def _flush(self, group):
+        try:
+            await self.on_flush(group)
+        except Exception as e:
+            logger.error("Error flushing media group %s: %s", group['group_id'], e)
@@ -0,0 +1,182 @@
+import functools
+import math
+import threading
+import time
+
+from aiohttp import web
+
+from log import get_logger
+
+logger = get_logger("metrics")
+
+# Latency buckets in seconds, from a cached lookup to a flood-limited album
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+_metrics = []
+
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value))
+
+
+class Counter:
+    """Monotonic counter, safe to increment from any thread."""
+
+    type = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = list(self._values.items())
+        for key, value in values:
+            yield self.name + "_total", _format_labels(self.labelnames, key), value
+
+
+class Histogram:
+    """Cumulative histogram of observed values, safe to update from any thread."""
+
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # Label values -> [count per bucket, sum, count]
+        self._values = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def samples(self):
+        with self._lock:
+            values = [(key, list(state[0]), state[1], state[2]) for key, state in self._values.items()]
+        for key, bucket_counts, total, count in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, bucket_counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, [('le', _format_value(bound))])
+                yield self.name + "_bucket", labels, cumulative
+            yield self.name + "_sum", _format_labels(self.labelnames, key), total
+            yield self.name + "_count", _format_labels(self.labelnames, key), count
+
+
+class Gauge:
+    """Gauge whose value is read from ``fn`` whenever metrics are collected."""
+
+    type = "gauge"
+
+    def __init__(self, name, documentation, fn):
+        self.name = name
+        self.documentation = documentation
+        self.fn = fn
+        _metrics.append(self)
+
+    def samples(self):
+        try:
+            value = self.fn()
+        except Exception:
+            return
+        yield self.name, "", value
+
+
+def timed(histogram, **labels):
+    """Decorator observing the duration of every call of a coroutine function."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start, **labels)
+        return wrapper
+    return decorator
+
+
+def render():
+    """Render all metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in _metrics:
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.type}")
+        for name, labels, value in metric.samples():
+            lines.append(f"{name}{labels} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+# Metrics shared across modules
+STAGE_SECONDS = Histogram(
+    "bridge_stage_duration_seconds", "Duration of handlers and background cycles.", ["stage"]
+)
+BOT_API_CALLS = Counter(
+    "bridge_bot_api_calls", "Bot API calls by method and outcome.", ["method", "outcome"]
+)
+TELETHON_CALLS = Counter(
+    "bridge_telethon_calls", "Telethon requests by method and outcome.", ["method", "outcome"]
+)
+FALLBACKS = Counter(
+    "bridge_fallbacks", "Times a fallback path was taken.", ["path"]
+)
+SQLITE_SECONDS = Histogram(
+    "bridge_sqlite_duration_seconds", "Time spent in SQLite on the storage thread.", ["op"]
+)
+
+
+class MetricsServer:
+    """Serves ``render()`` at ``/metrics`` over HTTP."""
+
+    def __init__(self, listen="127.0.0.1", port=9464):
+        self.listen = listen
+        self.port = port
+        self._runner = None
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/metrics", self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.listen, self.port).start()
+        logger.info("Metrics served on %s:%s/metrics", self.listen, self.port)
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def _handle(self, request):
+        return web.Response(text=render(), content_type="text/plain", charset="utf-8")
@@ -0,0 +1,163 @@
+import asyncio
+import heapq
+import itertools
+import math
+
+from telegram.error import RetryAfter
+
+from log import get_logger
+from metrics import BOT_API_CALLS
+
+logger = get_logger("outbound")
+
+# Lower values are sent first
+PRIORITY_POST = 0
+PRIORITY_EDIT = 1
+PRIORITY_REACTION = 2
+PRIORITY_BACKFILL = 3
+
+
+def retry_after_seconds(error):
+    """Seconds to wait from a RetryAfter error, whether it holds an int or a timedelta."""
+    retry_after = error.retry_after
+    if hasattr(retry_after, 'total_seconds'):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+
+class TokenBucket:
+    """Token bucket refilled at ``rate`` tokens per second up to ``capacity`` tokens."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = None
+
+    def ready_at(self, now):
+        """Time at which a token will be available."""
+        self._refill(now)
+        if self.tokens >= 1:
+            return now
+        return now + (1 - self.tokens) / self.rate
+
+    def take(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+    def _refill(self, now):
+        if self.updated is not None:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+
+class OutboundScheduler:
+    """Central, flood-control-aware executor for Bot API calls.
+
+    Calls are queued per chat (taken from the ``chat_id`` keyword argument) and started
+    in priority order when both the chat's and the global token bucket allow it. Each
+    chat has at most one call in flight, so calls to a chat are made in submission order
+    within a priority. A RetryAfter error pauses the chat for the requested time and puts
+    the call back at the head of its queue, up to ``max_retries`` times.
+    """
+
+    def __init__(self, global_rate=25.0, global_burst=30, chat_rate=1.0, chat_burst=3,
+                 max_concurrency=8, max_retries=5):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self._global = TokenBucket(global_rate, global_burst)
+        self._chats = {}
+        self._seq = itertools.count()
+        self._in_flight = 0
+        self._wakeup = None
+        self._worker = None
+
+    def __len__(self):
+        return sum(len(chat['queue']) for chat in self._chats.values())
+
+    async def call(self, priority, method, *args, **kwargs):
+        """Schedule ``method(*args, **kwargs)`` and return its result."""
+        loop = asyncio.get_running_loop()
+        if self._worker is None or self._worker.done():
+            self._wakeup = asyncio.Event()
+            self._worker = loop.create_task(self._run())
+
+        chat = self._chats.get(kwargs.get('chat_id'))
+        if chat is None:
+            chat = self._chats[kwargs.get('chat_id')] = {
+                'queue': [],
+                'bucket': TokenBucket(self.chat_rate, self.chat_burst),
+                'blocked_until': 0.0,
+                'busy': False,
+            }
+        future = loop.create_future()
+        job = {'method': method, 'args': args, 'kwargs': kwargs, 'future': future, 'attempt': 0}
+        heapq.heappush(chat['queue'], (priority, next(self._seq), job))
+        self._wakeup.set()
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            self._wakeup.clear()
+            now = loop.time()
+            best = None
+            next_ready = math.inf
+            if self._in_flight < self.max_concurrency:
+                for chat in self._chats.values():
+                    if chat['busy'] or not chat['queue']:
+                        continue
+                    ready_at = max(chat['blocked_until'], chat['bucket'].ready_at(now))
+                    if ready_at > now:
+                        next_ready = min(next_ready, ready_at)
+                    elif best is None or chat['queue'][0][:2] < best['queue'][0][:2]:
+                        best = chat
+
+            if best is not None:
+                next_ready = self._global.ready_at(now)
+                if next_ready <= now:
+                    self._global.take(now)
+                    best['bucket'].take(now)
+                    best['busy'] = True
+                    self._in_flight += 1
+                    loop.create_task(self._execute(best, heapq.heappop(best['queue'])))
+                    continue
+
+            timeout = None if next_ready == math.inf else next_ready - now
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _execute(self, chat, item):
+        priority, seq, job = item
+        future = job['future']
+        method_name = getattr(job['method'], '__name__', 'call')
+        try:
+            if future.cancelled():
+                return
+            result = await job['method'](*job['args'], **job['kwargs'])
+        except RetryAfter as e:
+            BOT_API_CALLS.inc(method=method_name, outcome='retry_after')
+            delay = retry_after_seconds(e)
+            chat['blocked_until'] = asyncio.get_running_loop().time() + delay
+            if job['attempt'] < self.max_retries:
+                job['attempt'] += 1
+                logger.warning("Flood control in chat %s, retrying %s in %ss", job['kwargs'].get('chat_id'), method_name, delay)
+                heapq.heappush(chat['queue'], item)
+            elif not future.done():
+                future.set_exception(e)
+        except Exception as e:
+            BOT_API_CALLS.inc(method=method_name, outcome='error')
+            if not future.done():
+                future.set_exception(e)
+        else:
+            BOT_API_CALLS.inc(method=method_name, outcome='ok')
+            if not future.done():
+                future.set_result(result)
+        finally:
+            chat['busy'] = False
+            self._in_flight -= 1
+            self._wakeup.set()
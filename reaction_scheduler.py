@@ -0,0 +1,125 @@
+import heapq
+import math
+import random
+import time
+
+
+def parse_tiers(spec):
+    """Parse "max_age:interval,..." (seconds, "inf" allowed for the age) into sorted tiers."""
+    tiers = []
+    for item in spec.split(','):
+        max_age, interval = item.split(':')
+        tiers.append((float(max_age), float(interval)))
+    return sorted(tiers)
+
+
+class ReactionPollScheduler:
+    """Per-message reaction polling schedule.
+
+    Every tracked message has its own next poll time, kept in a heap. The polling interval
+    grows with the message's age according to ``tiers`` (a sorted list of
+    ``(max_age, interval)`` pairs), while messages whose reactions changed within
+    ``active_window`` seconds are polled every ``active_interval`` seconds. Each cycle
+    takes at most ``budget`` requests of up to ``batch_size`` messages, the most overdue
+    messages first. Messages older than ``max_age`` seconds are dropped once polled.
+    """
+
+    def __init__(self, tiers, active_window=600, active_interval=5, budget=5, batch_size=100, max_age=None):
+        self.tiers = tiers
+        self.max_age = max_age
+        self.active_window = active_window
+        self.active_interval = active_interval
+        self.budget = budget
+        self.batch_size = batch_size
+        self._heap = []
+        # (channel_id, message_id) -> [posted_at, last_activity, due]
+        self._messages = {}
+
+    def __len__(self):
+        return len(self._messages)
+
+    def add(self, channel_id, message_id, posted_at=None, now=None, jitter=False):
+        """Start tracking a message. ``jitter`` spreads the first poll over one interval."""
+        now = time.time() if now is None else now
+        key = (channel_id, message_id)
+        if key in self._messages:
+            return
+        state = [now if posted_at is None else posted_at, 0.0, 0.0]
+        if self._expired(state, now):
+            return
+        self._messages[key] = state
+        interval = self._interval(state, now)
+        self._schedule(key, state, now + (random.uniform(0, interval) if jitter else interval))
+
+    def touch(self, channel_id, message_id, now=None):
+        """Record reaction activity on a message, moving it to the fast polling rate."""
+        now = time.time() if now is None else now
+        key = (channel_id, message_id)
+        state = self._messages.get(key)
+        if state is None:
+            return
+        state[1] = now
+        due = now + self.active_interval
+        if due < state[2]:
+            self._schedule(key, state, due)
+
+    def pop_due(self, now=None):
+        """Take the messages due for polling this cycle, grouped as {channel_id: [message_id, ...]}.
+
+        Popped messages stay tracked but are not scheduled again until ``reschedule`` is called.
+        """
+        now = time.time() if now is None else now
+        batches = {}
+        requests = 0
+        while self._heap and self._heap[0][0] <= now:
+            due, channel_id, message_id = self._heap[0]
+            state = self._messages.get((channel_id, message_id))
+            if state is None or state[2] != due:
+                # Stale entry left behind by a reschedule or removal
+                heapq.heappop(self._heap)
+                continue
+            batch = batches.setdefault(channel_id, [])
+            if len(batch) % self.batch_size == 0:
+                if requests >= self.budget:
+                    if not batch:
+                        del batches[channel_id]
+                    break
+                requests += 1
+            heapq.heappop(self._heap)
+            state[2] = math.inf
+            batch.append(message_id)
+        return batches
+
+    def reschedule(self, channel_id, message_id, changed=False, now=None):
+        """Schedule the next poll of a message after it has been polled."""
+        now = time.time() if now is None else now
+        key = (channel_id, message_id)
+        state = self._messages.get(key)
+        if state is None:
+            return
+        if self._expired(state, now):
+            self.remove(channel_id, message_id)
+            return
+        if changed:
+            state[1] = now
+        self._schedule(key, state, now + self._interval(state, now))
+
+    def remove(self, channel_id, message_id):
+        self._messages.pop((channel_id, message_id), None)
+
+    def _expired(self, state, now):
+        return self.max_age is not None and now - state[0] > self.max_age
+
+    def _interval(self, state, now):
+        posted_at, last_activity, _ = state
+        if now - last_activity < self.active_window:
+            return self.active_interval
+        age = now - posted_at
+        for max_age, interval in self.tiers:
+            if age < max_age:
+                return interval
+        return self.tiers[-1][1]
+
+    def _schedule(self, key, state, due):
+        state[2] = due
+        heapq.heappush(self._heap, (due, key[0], key[1]))
@@ -0,0 +1,138 @@
+import hashlib
+
+CUSTOM_EMOJI_TO_ID_MAP = {
+    '(B)': 5224647090734375337,
+    '[токнау]': 5307977565175029928,
+    '(токнау)': 5305776162507596250,
+    '𝕋𝕒𝕝': 5307935766553304360,
+    '𝕜ℕ': 5305747476421027973,
+    '𝕠𝕨': 5305495104142713367,
+    '𝐓𝐚𝐥': 5307801694854191826,
+    '𝐤𝐍': 5308050107172659858,
+    '𝐨𝐰': 5305459232575857422,
+    'юрец': 5307972372559568260,
+    'гол': 5262944983400334596,
+    'гоол': 5262983208609269585,
+    'гооол': 5263001522349819939,
+    'натер': 4978814394050806930,
+}
+ID_TO_CUSTOM_EMOJI_MAP = {v:k for k,v in CUSTOM_EMOJI_TO_ID_MAP.items()}
+
+
+def encode_reaction(reaction):
+    """Compact code of a reaction: the document ID of known custom emoji, the emoji itself otherwise."""
+    return CUSTOM_EMOJI_TO_ID_MAP.get(reaction, reaction)
+
+
+def decode_reaction(code):
+    return ID_TO_CUSTOM_EMOJI_MAP.get(code, code) if isinstance(code, int) else code
+
+
+def reactions_fingerprint(reactions):
+    """Stable signed 64-bit fingerprint of a reactions dict, equal for equal reaction counts."""
+    canonical = "\x1f".join(f"{reaction}\x1e{count}" for reaction, count in sorted(reactions.items()))
+    return int.from_bytes(hashlib.blake2b(canonical.encode(), digest_size=8).digest(), 'big', signed=True)
+
+
+class ReactionState:
+    """In-memory reaction counts of every message, persisted behind the scenes.
+
+    Counts are keyed by ``(channel_id, message_id)`` and loaded from the database once at
+    startup, along with the fingerprint of the counts last observed on Telegram, which can
+    be lower than the kept counts when reactions are removed. Changed messages are marked dirty until ``take_dirty`` hands them over to be
+    written in one batch. Copies of the same post are linked into a group whose combined
+    counts are updated by the difference on every change, so they never have to be summed
+    over the copies again.
+    """
+
+    def __init__(self):
+        self._counts = {}
+        self._fingerprints = {}
+        self._dirty = set()
+        self._groups = {}
+
+    def __len__(self):
+        return len(self._counts)
+
+    def __contains__(self, key):
+        return key in self._counts
+
+    def dirty_count(self):
+        return len(self._dirty)
+
+    def is_dirty(self, key):
+        return key in self._dirty
+
+    def load(self, key, counts, fingerprint=None):
+        """Add stored counts without marking them dirty."""
+        self._counts[key] = counts
+        self._fingerprints[key] = reactions_fingerprint(counts) if fingerprint is None else fingerprint
+
+    def get(self, key):
+        return dict(self._counts.get(key, {}))
+
+    def changed(self, key, reactions):
+        """Whether ``reactions`` differ from the counts last observed for a message."""
+        return self._fingerprints.get(key) != reactions_fingerprint(reactions)
+
+    def set(self, key, reactions, observed=None):
+        """
+        Replace the counts of a message and update the combined counts of its group. ``observed``
+        are the counts seen on Telegram that ``reactions`` were derived from, if they differ.
+        """
+        old = self._counts.get(key, {})
+        reactions = dict(reactions)
+        self._counts[key] = reactions
+        self._fingerprints[key] = reactions_fingerprint(reactions if observed is None else observed)
+        self._dirty.add(key)
+        group = self._groups.get(key)
+        if group is not None:
+            combined = group['combined']
+            for reaction in old.keys() | reactions.keys():
+                count = combined.get(reaction, 0) + reactions.get(reaction, 0) - old.get(reaction, 0)
+                if count > 0:
+                    combined[reaction] = count
+                else:
+                    combined.pop(reaction, None)
+
+    def link(self, keys):
+        """Group the copies of one post, merging any groups they already belong to."""
+        group = self._groups.get(keys[0])
+        if group is not None and all(self._groups.get(key) is group for key in keys):
+            return
+        members = set(keys)
+        for key in keys:
+            if key in self._groups:
+                members |= self._groups[key]['members']
+        combined = {}
+        for key in members:
+            for reaction, count in self._counts.get(key, {}).items():
+                combined[reaction] = combined.get(reaction, 0) + count
+        group = {'members': members, 'combined': combined}
+        for key in members:
+            self._groups[key] = group
+
+    def combined(self, key):
+        """Combined counts of the group of a message, or its own counts if it is not linked."""
+        group = self._groups.get(key)
+        return dict(group['combined']) if group is not None else self.get(key)
+
+    def take_dirty(self):
+        """Return ``(key, counts, fingerprint)`` of the messages changed since the last call."""
+        dirty, self._dirty = self._dirty, set()
+        return [(key, self._counts[key], self._fingerprints[key]) for key in dirty if key in self._counts]
+
+    def mark_dirty(self, keys):
+        """Mark messages dirty again, after their flush failed."""
+        self._dirty.update(keys)
+
+    def forget(self, keys):
+        """Drop messages from memory, unlinking them from their groups."""
+        for key in keys:
+            if key in self._groups:
+                # Take the message out of the combined counts before unlinking it
+                self.set(key, {})
+                self._groups.pop(key)['members'].discard(key)
+            self._counts.pop(key, None)
+            self._fingerprints.pop(key, None)
+            self._dirty.discard(key)
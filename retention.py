@@ -0,0 +1,84 @@
+import json
+
+
+def _archive_chunk(conn, cutoff, limit):
+    # Mappings without a creation time are as old as the migration that recorded them
+    undated = conn.execute("SELECT dated_at FROM undated_mappings").fetchone()
+    condition = "created_at < ? OR created_at IS NULL" if undated and undated[0] < cutoff else "created_at < ?"
+    rowids = [row[0] for row in conn.execute(
+        f"SELECT rowid FROM message_mapping WHERE {condition} LIMIT ?", (cutoff, limit)
+    )]
+    if not rowids:
+        return 0
+    selected = "SELECT value FROM json_each(?)"
+    ids = json.dumps(rowids)
+    # Bodies of archived posts are dropped, they are fetched from Telegram again if ever needed
+    conn.execute(f"""
+        DELETE FROM message_bodies WHERE (channel_id, message_id) IN (
+            SELECT original_channel, original_id FROM message_mapping WHERE rowid IN ({selected})
+            UNION ALL
+            SELECT copied_channel, copied_id FROM message_mapping WHERE rowid IN ({selected})
+        )
+    """, (ids, ids))
+    conn.execute(f"""
+        INSERT OR IGNORE INTO archive.message_mapping (original_channel, original_id, copied_channel, copied_id, created_at)
+        SELECT original_channel, original_id, copied_channel, copied_id, created_at FROM message_mapping
+        WHERE rowid IN ({selected})
+    """, (ids,))
+    conn.execute(f"DELETE FROM message_mapping WHERE rowid IN ({selected})", (ids,))
+    return len(rowids)
+
+
+async def archive_mappings(storage, cutoff, chunk_rows=1000):
+    """
+    Move mappings created before ``cutoff`` to the archive database and delete the stored bodies
+    of their messages, ``chunk_rows`` mappings per transaction.
+    """
+    archived = 0
+    while True:
+        count = await storage.write(lambda conn: _archive_chunk(conn, cutoff, chunk_rows))
+        archived += count
+        if count < chunk_rows:
+            return archived
+
+
+async def find_stale_reactions(storage, cutoff):
+    """Return the (channel_id, message_id) of the messages whose reactions were last updated before ``cutoff``."""
+    rows = await storage.fetchall(
+        "SELECT channel_id, message_id FROM message_reactions WHERE last_updated < ?", (cutoff,)
+    )
+    return [tuple(row) for row in rows]
+
+
+async def prune_reactions(storage, keys, chunk_rows=1000):
+    """Delete the reactions of the given (channel_id, message_id), ``chunk_rows`` messages per transaction."""
+    for start in range(0, len(keys), chunk_rows):
+        chunk = keys[start:start + chunk_rows]
+
+        def delete(conn):
+            conn.executemany("DELETE FROM reaction_counts WHERE channel_id = ? AND message_id = ?", chunk)
+            conn.executemany("DELETE FROM message_reactions WHERE channel_id = ? AND message_id = ?", chunk)
+
+        await storage.write(delete)
+
+
+async def incremental_vacuum(storage, chunk_pages=256):
+    """Return the free pages of the database to the file system, ``chunk_pages`` per transaction."""
+    freed = 0
+    previous_free_pages = None
+    while True:
+        free_pages = (await storage.fetchone("PRAGMA freelist_count"))[0]
+        if previous_free_pages is not None:
+            freed += previous_free_pages - free_pages
+        # Nothing is freed when the database does not use incremental auto-vacuum
+        if not free_pages or free_pages == previous_free_pages:
+            return freed
+        previous_free_pages = free_pages
+        pages = min(free_pages, chunk_pages)
+
+        def vacuum(conn):
+            # Python's sqlite3 steps the pragma only once, and every step frees one page
+            for _ in range(pages):
+                conn.execute("PRAGMA incremental_vacuum(1)")
+
+        await storage.write(vacuum)
@@ -0,0 +1,54 @@
+import asyncio
+
+
+def parse_shard_groups(spec):
+    """Parse "chan,chan,...;chan,chan,..." into a list of channel ID tuples."""
+    groups = []
+    for group in spec.split(';'):
+        channels = tuple(int(channel) for channel in group.split(',') if channel.strip())
+        if channels:
+            groups.append(channels)
+    return groups
+
+
+class ShardGroups:
+    """Groups of channels whose posts are mirrored to every other member of the group."""
+
+    def __init__(self, groups):
+        self.groups = [tuple(group) for group in groups]
+        self._group_of = {}
+        for group in self.groups:
+            if len(group) < 2:
+                raise ValueError(f"Shard group {group} needs at least two channels")
+            for channel_id in group:
+                if channel_id in self._group_of:
+                    raise ValueError(f"Channel {channel_id} belongs to more than one shard group")
+                self._group_of[channel_id] = group
+
+    def __contains__(self, channel_id):
+        return channel_id in self._group_of
+
+    @property
+    def channels(self):
+        return list(self._group_of)
+
+    def members(self, channel_id):
+        """All channels of the channel's group, including itself."""
+        return self._group_of.get(channel_id, ())
+
+    def peers(self, channel_id):
+        """The other channels of the channel's group, the ones its posts are copied to."""
+        return tuple(member for member in self.members(channel_id) if member != channel_id)
+
+
+async def fan_out(semaphore, targets, fn):
+    """Call ``fn(target)`` for every target concurrently, bounded by ``semaphore``.
+
+    Returns a dict of target -> result, with the exception as the result for failed targets.
+    """
+    async def run(target):
+        async with semaphore:
+            return await fn(target)
+
+    results = await asyncio.gather(*(run(target) for target in targets), return_exceptions=True)
+    return dict(zip(targets, results))
@@ -0,0 +1,338 @@
+import asyncio
+import json
+import queue
+import sqlite3
+import threading
+import time
+
+from log import get_logger
+from reactions import encode_reaction, reactions_fingerprint
+from metrics import SQLITE_SECONDS
+
+logger = get_logger("storage")
+
+
+def _create_tables(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS message_mapping
+                (original_channel INTEGER, original_id INTEGER, copied_channel INTEGER, copied_id INTEGER)''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS message_reactions
+                (channel_id INTEGER,
+                 message_id INTEGER,
+                 reaction_data TEXT,
+                 last_updated INTEGER,
+                 PRIMARY KEY (channel_id, message_id))''')
+
+
+def _index_message_mapping(conn):
+    # Older databases may hold duplicate rows, keep the first one so the unique indexes can be built
+    conn.execute('''DELETE FROM message_mapping WHERE rowid NOT IN
+                (SELECT MIN(rowid) FROM message_mapping
+                 GROUP BY original_channel, original_id, copied_channel, copied_id)''')
+    # Both indexes contain every column, so lookups in either direction never touch the table
+    conn.execute('''CREATE UNIQUE INDEX IF NOT EXISTS idx_mapping_original
+                ON message_mapping (original_channel, original_id, copied_channel, copied_id)''')
+    conn.execute('''CREATE UNIQUE INDEX IF NOT EXISTS idx_mapping_copied
+                ON message_mapping (copied_channel, copied_id, original_channel, original_id)''')
+
+
+def _add_mapping_created_at(conn):
+    # Rows stored before this migration keep a NULL creation time
+    conn.execute("ALTER TABLE message_mapping ADD COLUMN created_at INTEGER")
+
+
+def _create_message_bodies(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS message_bodies
+                (channel_id INTEGER,
+                 message_id INTEGER,
+                 body TEXT,
+                 entities TEXT,
+                 is_media INTEGER,
+                 footer TEXT,
+                 PRIMARY KEY (channel_id, message_id)) WITHOUT ROWID''')
+
+
+def _create_outbox(conn):
+    # Incoming posts are journaled here until they have been mirrored
+    conn.execute('''CREATE TABLE IF NOT EXISTS outbox
+                (channel_id INTEGER,
+                 message_id INTEGER,
+                 payload TEXT,
+                 attempts INTEGER NOT NULL DEFAULT 0,
+                 created_at INTEGER,
+                 PRIMARY KEY (channel_id, message_id))''')
+
+
+def _normalize_reactions(conn):
+    # Reaction counts move from a JSON column to one row per reaction, and every message gets
+    # a fingerprint of its counts so that unchanged reactions are detected without reading them
+    conn.execute('''CREATE TABLE IF NOT EXISTS reaction_counts
+                (channel_id INTEGER,
+                 message_id INTEGER,
+                 reaction_code,
+                 count INTEGER,
+                 PRIMARY KEY (channel_id, message_id, reaction_code)) WITHOUT ROWID''')
+    conn.execute("ALTER TABLE message_reactions ADD COLUMN fingerprint INTEGER")
+    rows = conn.execute("SELECT channel_id, message_id, reaction_data FROM message_reactions").fetchall()
+    for channel_id, message_id, reaction_data in rows:
+        reactions = json.loads(reaction_data) if reaction_data else {}
+        conn.executemany(
+            "INSERT OR REPLACE INTO reaction_counts (channel_id, message_id, reaction_code, count) VALUES (?, ?, ?, ?)",
+            [(channel_id, message_id, encode_reaction(reaction), count) for reaction, count in reactions.items()]
+        )
+        conn.execute(
+            "UPDATE message_reactions SET fingerprint = ? WHERE channel_id = ? AND message_id = ?",
+            (reactions_fingerprint(reactions), channel_id, message_id)
+        )
+    conn.execute("ALTER TABLE message_reactions DROP COLUMN reaction_data")
+
+
+def _create_backfill_state(conn):
+    # Highest message ID of each channel the backfill has caught up to
+    conn.execute('''CREATE TABLE IF NOT EXISTS backfill_state
+                (channel_id INTEGER PRIMARY KEY,
+                 last_message_id INTEGER,
+                 updated_at INTEGER)''')
+
+
+def _index_retention(conn):
+    # The retention job selects mappings and reactions by age
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_mapping_created_at ON message_mapping (created_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_reactions_last_updated ON message_reactions (last_updated)")
+
+
+def _record_undated_mappings(conn):
+    # Rows stored before creation times were recorded keep a NULL creation time, so reaction polling
+    # still treats them as old posts. Retention ages them from the time of this migration instead.
+    conn.execute("CREATE TABLE IF NOT EXISTS undated_mappings (dated_at INTEGER NOT NULL)")
+    conn.execute("INSERT INTO undated_mappings (dated_at) VALUES (?)", (int(time.time()),))
+
+
+# Schema migrations, applied in order. The index of a migration in this list plus one is the
+# schema version it produces; never reorder or edit a migration that has been released.
+MIGRATIONS = [
+    _create_tables,
+    _index_message_mapping,
+    _add_mapping_created_at,
+    _create_message_bodies,
+    _create_outbox,
+    _normalize_reactions,
+    _create_backfill_state,
+    _index_retention,
+    _record_undated_mappings,
+]
+
+
+def migrate(conn):
+    """Bring the database schema up to date, one transaction per migration."""
+    conn.execute("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)")
+    row = conn.execute("SELECT version FROM schema_version").fetchone()
+    if row is None:
+        conn.execute("INSERT INTO schema_version (version) VALUES (0)")
+        version = 0
+    else:
+        version = row[0]
+
+    for target_version, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        logger.info("Migrating database schema to version %s", target_version)
+        conn.execute("BEGIN")
+        try:
+            migration(conn)
+            conn.execute("UPDATE schema_version SET version = ?", (target_version,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+
+def _create_archive(conn):
+    # Mappings of old posts, kept in a separate file attached as "archive"
+    conn.execute('''CREATE TABLE IF NOT EXISTS archive.message_mapping
+                (original_channel INTEGER, original_id INTEGER, copied_channel INTEGER, copied_id INTEGER,
+                 created_at INTEGER)''')
+    conn.execute('''CREATE UNIQUE INDEX IF NOT EXISTS archive.idx_mapping_original
+                ON message_mapping (original_channel, original_id, copied_channel, copied_id)''')
+    conn.execute('''CREATE UNIQUE INDEX IF NOT EXISTS archive.idx_mapping_copied
+                ON message_mapping (copied_channel, copied_id, original_channel, original_id)''')
+
+
+_STOP = object()
+
+
+def _resolve(future, result, error):
+    if future.cancelled():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+
+def _notify(loop, future, result=None, error=None):
+    try:
+        loop.call_soon_threadsafe(_resolve, future, result, error)
+    except RuntimeError:
+        # The caller's loop has already been closed, nobody is waiting anymore
+        pass
+
+
+class Storage:
+    """SQLite database owned by a single background thread.
+
+    Every statement runs on that thread, so the event loop never waits on disk I/O.
+    Writes are grouped: the first write opens a transaction which is committed once
+    ``commit_window`` seconds have passed or ``max_batch`` writes are pending, and each
+    write's awaitable resolves only after its commit. Reads run on the same connection
+    and therefore always observe writes queued before them.
+
+    With ``archive_path`` a second database is attached as ``archive`` for old mappings.
+    The main database uses incremental auto-vacuum, so that pages freed by deletions can
+    be returned to the file system in small steps.
+    """
+
+    def __init__(self, path, commit_window=0.02, max_batch=256, archive_path=None):
+        self.path = path
+        self.archive_path = archive_path
+        self.commit_window = commit_window
+        self.max_batch = max_batch
+        self._queue = queue.SimpleQueue()
+        self._ready = threading.Event()
+        self._init_error = None
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="storage", daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        if self._init_error is not None:
+            raise self._init_error
+
+    # Public API
+    async def execute(self, sql, params=()):
+        """Run a single write statement and wait for it to be committed."""
+        return await self.write(lambda conn: conn.execute(sql, params).rowcount)
+
+    async def executemany(self, sql, seq_of_params):
+        """Run a write statement for every parameter tuple inside one transaction."""
+        rows = list(seq_of_params)
+        return await self.write(lambda conn: conn.executemany(sql, rows).rowcount)
+
+    async def fetchone(self, sql, params=()):
+        return await self.read(lambda conn: conn.execute(sql, params).fetchone())
+
+    async def fetchall(self, sql, params=()):
+        return await self.read(lambda conn: conn.execute(sql, params).fetchall())
+
+    async def write(self, fn):
+        """Call ``fn(conn)`` inside the current write batch and wait for the commit."""
+        return await self._submit(fn, True)
+
+    async def read(self, fn):
+        """Call ``fn(conn)`` on the storage thread and return its result."""
+        return await self._submit(fn, False)
+
+    def close(self):
+        """Commit pending writes and stop the storage thread."""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_STOP)
+        self._thread.join()
+
+    # Internals
+    async def _submit(self, fn, is_write):
+        if self._closed:
+            raise RuntimeError("Storage is closed")
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._queue.put((fn, is_write, future, loop))
+        return await future
+
+    def _run(self):
+        try:
+            conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+            # Takes effect at once on a new database, existing ones are rebuilt below
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            # WAL lets commits append to the log instead of rewriting pages, and NORMAL sync
+            # is still crash-safe in WAL mode
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            migrate(conn)
+            if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+                logger.info("Rebuilding the database once to enable incremental vacuum")
+                conn.execute("VACUUM")
+            if self.archive_path:
+                conn.execute("ATTACH DATABASE ? AS archive", (self.archive_path,))
+                conn.execute("PRAGMA archive.journal_mode=WAL")
+                _create_archive(conn)
+        except Exception as e:
+            self._init_error = e
+            self._ready.set()
+            return
+        self._ready.set()
+
+        pending = []
+        deadline = None
+        while True:
+            timeout = None if not pending else max(0.0, deadline - time.monotonic())
+            try:
+                op = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                self._commit(conn, pending)
+                pending = []
+                continue
+
+            if op is _STOP:
+                self._commit(conn, pending)
+                break
+
+            fn, is_write, future, loop = op
+            start = time.perf_counter()
+            if not is_write:
+                try:
+                    result, error = fn(conn), None
+                except Exception as e:
+                    result, error = None, e
+                SQLITE_SECONDS.observe(time.perf_counter() - start, op="read")
+                _notify(loop, future, result, error)
+                continue
+
+            if not pending:
+                conn.execute("BEGIN")
+                deadline = time.monotonic() + self.commit_window
+            # A savepoint per write keeps one failing statement from discarding the batch
+            conn.execute("SAVEPOINT op")
+            try:
+                result = fn(conn)
+                conn.execute("RELEASE op")
+                pending.append((future, loop, result))
+            except Exception as e:
+                conn.execute("ROLLBACK TO op")
+                conn.execute("RELEASE op")
+                _notify(loop, future, error=e)
+                if not pending:
+                    conn.execute("COMMIT")
+                continue
+            finally:
+                SQLITE_SECONDS.observe(time.perf_counter() - start, op="write")
+
+            if len(pending) >= self.max_batch:
+                self._commit(conn, pending)
+                pending = []
+
+        conn.close()
+
+    def _commit(self, conn, pending):
+        if not pending:
+            return
+        error = None
+        start = time.perf_counter()
+        try:
+            conn.execute("COMMIT")
+        except Exception as e:
+            logger.error("Storage commit of %s writes failed: %s", len(pending), e)
+            error = e
+            try:
+                conn.execute("ROLLBACK")
+            except sqlite3.Error:
+                pass
+        SQLITE_SECONDS.observe(time.perf_counter() - start, op="commit")
+        for future, loop, result in pending:
+            _notify(loop, future, result, error)
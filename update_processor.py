@@ -0,0 +1,57 @@
+import asyncio
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+
+class KeyedUpdateProcessor(BaseUpdateProcessor):
+    """Processes updates of different chats concurrently and those of one chat in order.
+
+    Updates are keyed by their chat. An update starts only after every earlier update of
+    its chat has finished, and at most ``max_running`` updates run at once overall. Up to
+    ``max_concurrent_updates`` updates may be in progress, including those waiting for
+    their turn.
+    """
+
+    def __init__(self, max_running, max_concurrent_updates=1000):
+        super().__init__(max_concurrent_updates)
+        self.max_running = max_running
+        self._running = asyncio.Semaphore(max_running)
+        # Chat -> future of the last update of that chat, resolved once it has been processed
+        self._tails = {}
+
+    @staticmethod
+    def get_key(update):
+        if isinstance(update, Update) and update.effective_chat:
+            return update.effective_chat.id
+        return None
+
+    async def do_process_update(self, update, coroutine):
+        key = self.get_key(update)
+        if key is None:
+            async with self._running:
+                await coroutine
+            return
+
+        previous = self._tails.get(key)
+        done = asyncio.get_running_loop().create_future()
+        self._tails[key] = done
+        started = False
+        try:
+            if previous is not None:
+                await asyncio.shield(previous)
+            async with self._running:
+                started = True
+                await coroutine
+        finally:
+            if not started:
+                coroutine.close()
+            done.set_result(None)
+            if self._tails.get(key) is done:
+                del self._tails[key]
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
@@ -0,0 +1,74 @@
+import asyncio
+import hmac
+import secrets
+
+from aiohttp import web
+from telegram import Update
+
+from log import get_logger
+
+logger = get_logger("webhook")
+
+SECRET_TOKEN_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class WebhookServer:
+    """Embedded aiohttp server receiving updates pushed by Telegram.
+
+    Updates are put on the application's update queue without waiting. Requests without
+    the expected secret token are rejected with 403, and 503 is returned while the queue
+    is full so that Telegram delivers the update again later.
+    """
+
+    def __init__(self, application, url, listen="0.0.0.0", port=8443, path="/telegram", secret_token=None):
+        self.application = application
+        self.url = url
+        self.listen = listen
+        self.port = port
+        self.path = path
+        # Telegram accepts 1-256 characters of A-Z, a-z, 0-9, _ and -
+        self.secret_token = secret_token or secrets.token_urlsafe(32)
+        self._runner = None
+
+    async def start(self, allowed_updates=None):
+        """Start listening and point the bot's webhook at ``url``."""
+        app = web.Application()
+        app.router.add_post(self.path, self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        try:
+            await web.TCPSite(self._runner, self.listen, self.port).start()
+            await self.application.bot.set_webhook(
+                url=self.url,
+                secret_token=self.secret_token,
+                allowed_updates=allowed_updates,
+            )
+        except Exception:
+            await self.stop()
+            raise
+        logger.info("Webhook server listening on %s:%s%s", self.listen, self.port, self.path)
+
+    async def stop(self):
+        # The webhook itself stays set, Telegram keeps updates until the server is back
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def _handle(self, request):
+        token = request.headers.get(SECRET_TOKEN_HEADER, "")
+        if not hmac.compare_digest(token, self.secret_token):
+            logger.warning("Rejected webhook request from %s with an invalid secret token", request.remote)
+            return web.Response(status=403)
+
+        try:
+            update = Update.de_json(await request.json(), self.application.bot)
+        except Exception as e:
+            logger.warning("Rejected malformed webhook update: %s", e)
+            return web.Response(status=400)
+
+        try:
+            self.application.update_queue.put_nowait(update)
+        except asyncio.QueueFull:
+            logger.warning("Update queue is full, asking Telegram to resend update %s", update.update_id)
+            return web.Response(status=503)
+        return web.Response()